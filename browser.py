@@ -0,0 +1,239 @@
+# browser.py
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright
+from config import (
+    AUTH_STATE_FILE,
+    CHROMIUM_ARGS,
+    CONTEXT_MAX_AGE,
+    MAX_PARALLEL_TABS,
+    PAGE_RECYCLE_INTERVAL,
+    RUN_INTERVAL_ENV,
+    VIEWPORT,
+)
+from logger import StructuredLogger
+from login import login_to_support, resume_session
+
+logger = StructuredLogger(__name__)
+
+# Nothing we read depends on these, so they are never downloaded
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media", "stylesheet"})
+BLOCKED_URL_PARTS = (
+    "google-analytics",
+    "googletagmanager",
+    "gtag",
+    "hotjar",
+    "facebook",
+)
+
+
+async def _route_request(route):
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(
+        part in request.url for part in BLOCKED_URL_PARTS
+    ):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def block_unneeded_resources(context):
+    """Abort images, fonts, styles and analytics requests for a context.
+
+    Scripts still load, since the tickets listing is built by DataTables.
+    """
+    await context.route("**/*", _route_request)
+    return context
+
+
+async def _new_page_in_context(browser, **context_options):
+    context = await block_unneeded_resources(
+        await browser.new_context(viewport=VIEWPORT, **context_options)
+    )
+    return context, await context.new_page()
+
+
+async def open_logged_in_context(browser, state_file=AUTH_STATE_FILE):
+    """Open a logged-in context and its landing page.
+
+    The session saved by the last login is reused while the server still
+    accepts it; otherwise this logs in and saves the new session. Returns
+    (None, None) if logging in fails.
+    """
+    if os.path.exists(state_file):
+        context, page = await _new_page_in_context(browser, storage_state=state_file)
+        if await resume_session(page):
+            return context, page
+        await context.close()
+
+    context, page = await _new_page_in_context(browser)
+    if not await login_to_support(page):
+        await context.close()
+        return None, None
+    await context.storage_state(path=state_file)
+    # The file holds session cookies
+    os.chmod(state_file, 0o600)
+    return context, page
+
+
+class PagePool:
+    """A fixed set of reusable pages, one per concurrency slot.
+
+    Pages are navigated in place instead of being created and closed per
+    ticket, and are replaced after `max_uses` checkouts to bound the DOM and
+    heap growth a long-lived page accumulates.
+    """
+
+    def __init__(self, context, size=MAX_PARALLEL_TABS, max_uses=PAGE_RECYCLE_INTERVAL):
+        self.context = context
+        self.size = size
+        self.max_uses = max_uses
+        self._pages = asyncio.Queue()
+
+    async def _new_page(self):
+        return await self.context.new_page()
+
+    async def _close_page(self, page):
+        if not page.is_closed():
+            await page.close()
+
+    async def start(self):
+        for _ in range(self.size):
+            self._pages.put_nowait((await self._new_page(), 0))
+        logger.info(f"Started {type(self).__name__} with {self.size} pages")
+        return self
+
+    @asynccontextmanager
+    async def page(self):
+        page, uses = await self._pages.get()
+        try:
+            yield page
+        finally:
+            uses += 1
+            if page.is_closed() or uses >= self.max_uses:
+                try:
+                    await self._close_page(page)
+                    page, uses = await self._new_page(), 0
+                except Exception as e:
+                    logger.error(f"Failed to recycle pooled page: {str(e)}")
+            self._pages.put_nowait((page, uses))
+
+    async def close(self):
+        while not self._pages.empty():
+            page, _ = self._pages.get_nowait()
+            await self._close_page(page)
+
+
+class ContextPool(PagePool):
+    """A PagePool whose pages each live in their own browser context.
+
+    Contexts are cloned from the logged-in `context` via its storage state,
+    so they share the session without logging in again, but don't share
+    cookie jars, caches or storage with each other. `context` itself stays
+    available for session-wide work such as `context.request`.
+    """
+
+    def __init__(self, context, size=MAX_PARALLEL_TABS, max_uses=PAGE_RECYCLE_INTERVAL):
+        super().__init__(context, size, max_uses)
+        self._storage_state = None
+
+    async def _new_page(self):
+        _, page = await _new_page_in_context(
+            self.context.browser, storage_state=self._storage_state
+        )
+        return page
+
+    async def _close_page(self, page):
+        await page.context.close()
+
+    async def start(self):
+        self._storage_state = await self.context.storage_state()
+        return await super().start()
+
+
+class BrowserService:
+    """One Chromium instance and logged-in context shared across runs.
+
+    When a script is kept alive (JAMB_RUN_INTERVAL > 0) each run reuses the
+    same browser and session instead of paying Chromium start-up and a fresh
+    login; the context is replaced once it is older than `max_age`, or after
+    a run reports the session dead through `invalidate()`.
+    """
+
+    def __init__(self, headless=True, max_age=CONTEXT_MAX_AGE):
+        self.headless = headless
+        self.max_age = max_age
+        self._playwright = None
+        self._browser = None
+        self.context = None
+        self.page = None
+        self._context_started = 0.0
+
+    async def start(self):
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(
+            headless=self.headless, args=CHROMIUM_ARGS
+        )
+        logger.info("Browser started")
+        return self
+
+    async def get_context(self):
+        """Return a logged-in context, logging in again when it has expired.
+
+        The returned `page` is the post-login landing page. Returns None if
+        logging in fails.
+        """
+        expired = time.monotonic() - self._context_started > self.max_age
+        if self.context is None or expired or self.page.is_closed():
+            await self._close_context()
+            self.context, self.page = await open_logged_in_context(self._browser)
+            if self.context is None:
+                return None
+            self._context_started = time.monotonic()
+            logger.info("Started a new logged-in browser context")
+        return self.context
+
+    async def invalidate(self):
+        """Drop the context, e.g. after the server ended its session, so the
+        next get_context() logs in again."""
+        logger.warning("Discarding the logged-in browser context")
+        await self._close_context()
+
+    async def _close_context(self):
+        if self.context is not None:
+            try:
+                await self.context.close()
+            except Exception as e:
+                logger.warning(f"Failed to close browser context: {str(e)}")
+        self.context = None
+        self.page = None
+
+    async def stop(self):
+        await self._close_context()
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+        logger.info("Browser stopped")
+
+    async def serve(self, run, interval=None):
+        """Call `run(self)` once, or every `interval` seconds if it is set.
+
+        `interval` defaults to JAMB_RUN_INTERVAL, read here rather than at
+        import, since the scripts load .env after importing this module.
+        """
+        if interval is None:
+            interval = int(os.getenv(RUN_INTERVAL_ENV, "0"))
+        try:
+            while True:
+                try:
+                    await run(self)
+                except Exception as e:
+                    logger.error(f"An unexpected error occurred: {str(e)}")
+                if interval <= 0:
+                    break
+                await asyncio.sleep(interval)
+        finally:
+            await self.stop()
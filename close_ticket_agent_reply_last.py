@@ -1,64 +1,36 @@
 import asyncio
-import json
-from playwright.async_api import async_playwright
-import os
+import logging
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 from dotenv import load_dotenv
 
 # Import necessary functions from existing files
-from login import login_to_support
-from navigation import navigate_to_candidate_open_tickets_page
-from extraction import extract_ticket_ids, extract_ticket_info, extract_messages
-from validation import validate_message
+from navigation import navigate_to_candidate_open_tickets_page, navigate_to_ticket_page
+from extraction import extract_ticket_ids, get_ticket_data
+from login import SessionExpiredError
 from logger import logger
+from utils import dump_ticket_data, to_pretty_json
+from browser import BrowserService, ContextPool
+from config import MAX_PARALLEL_TABS
 
 load_dotenv()
 
 
-async def extract_ticket_data(context, ticket_id):
-    page = await context.new_page()
-    try:
-        url = f"https://support.jamb.gov.ng/agent/candidates-tickets/show/{ticket_id}"
-        await page.goto(url)
-        await page.wait_for_load_state("domcontentloaded")
-        await page.wait_for_selector(
-            'h1:has-text("Ticket")', state="visible", timeout=60000
-        )
-
-        ticket_info = await extract_ticket_info(page)
-        messages = await extract_messages(page, ticket_info.get("sender_name", ""))
-
-        ticket_data = {**ticket_info, "messages": messages}
-
-        # Log ticket data to console
-        print(f"Ticket {ticket_id} data:")
-        print(json.dumps(ticket_data, indent=2))
+def check_last_reply(ticket_data):
+    # build_messages only keeps valid messages, so the last one decides
+    messages = ticket_data.get("messages", [])
+    if not messages:
+        logger.warning(f"No valid messages found in ticket {ticket_data['ticket_id']}")
+        return False
 
-        return ticket_data, page
-    except Exception as e:
-        logger.error(f"Error processing ticket {ticket_id}: {str(e)}")
-        return None, None
-    finally:
-        if page.is_closed():
-            await page.close()
+    last_message = messages[-1]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Last message: {to_pretty_json(last_message)}")
 
+    if "agent_name" in last_message:
+        logger.info(f"Ticket {ticket_data['ticket_id']}: Agent was last to reply")
+        return True
 
-def check_last_reply(ticket_data):
-    messages = ticket_data.get("messages", [])
-    for message in reversed(messages):
-        if validate_message(message):
-            if "agent_name" in message:
-                logger.info(
-                    f"Ticket {ticket_data['ticket_id']}: Agent was last to reply"
-                )
-                logger.info(f"Last message: {json.dumps(message, indent=2)}")
-                return True
-            else:
-                logger.info(
-                    f"Ticket {ticket_data['ticket_id']}: Sender was last to reply"
-                )
-                logger.info(f"Last message: {json.dumps(message, indent=2)}")
-                return False
-    logger.warning(f"No valid messages found in ticket {ticket_data['ticket_id']}")
+    logger.info(f"Ticket {ticket_data['ticket_id']}: Sender was last to reply")
     return False
 
 
@@ -85,10 +57,7 @@ async def close_ticket(page, ticket_id):
         # Click the "Close" button
         await close_button.click()
 
-        # Wait for 1 second
-        await asyncio.sleep(1)
-
-        # Click the "Yes, close it!" button in the modal
+        # Click the "Yes, close it!" button in the modal as soon as it shows
         confirm_button = await page.wait_for_selector(
             'button.swal2-confirm.swal2-styled:has-text("Yes, close it!")',
             state="visible",
@@ -96,8 +65,14 @@ async def close_ticket(page, ticket_id):
         )
         await confirm_button.click()
 
-        # Wait for 3 seconds
-        await asyncio.sleep(3)
+        # Wait for the success dialog; if the page reloads instead, wait for
+        # the close request to finish.
+        try:
+            await page.wait_for_selector(
+                ".swal2-success, .swal2-icon-success", state="visible", timeout=10000
+            )
+        except PlaywrightTimeoutError:
+            await page.wait_for_load_state("networkidle", timeout=5000)
 
         logger.info(
             f"Ticket {ticket_id} (numeric ID: {numeric_id}) closed successfully"
@@ -106,49 +81,89 @@ async def close_ticket(page, ticket_id):
         logger.error(f"Error closing ticket {ticket_id}: {str(e)}")
 
 
-async def main():
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)  # Set to False for debugging
-        context = await browser.new_context(viewport={"width": 1920, "height": 1080})
-        page = await context.new_page()
+async def close_tickets(page, ticket_ids):
+    """Close the given tickets one after another on a single page.
 
-        try:
-            if not await login_to_support(page):
-                return
+    Runs after every ticket has been checked, so closing never competes
+    with extraction and never races on the server.
+    """
+    for ticket_id in ticket_ids:
+        # The close button's onclick is only wired up once the page has loaded
+        if await navigate_to_ticket_page(page, ticket_id, wait_until="load"):
+            await close_ticket(page, ticket_id)
+
+
+async def run_close(service):
+    context = await service.get_context()
+    if context is None:
+        return
 
-            candidate_page = await navigate_to_candidate_open_tickets_page(
-                page, context
+    pool = None
+    candidate_page = None
+    try:
+        candidate_page = await navigate_to_candidate_open_tickets_page(
+            service.page, context
+        )
+        if candidate_page is None:
+            # Most likely logged out; log in afresh on the next run
+            await service.invalidate()
+        else:
+            ticket_ids = await extract_ticket_ids(candidate_page)
+
+            pool = await ContextPool(context).start()
+            sem = asyncio.Semaphore(MAX_PARALLEL_TABS)
+
+            async def worker(ticket_id):
+                async with sem:
+                    ticket_data = await get_ticket_data(pool, ticket_id)
+                if ticket_data:
+                    dump_ticket_data(ticket_id, ticket_data)
+                return ticket_data
+
+            results = await asyncio.gather(
+                *(worker(ticket_id) for ticket_id in ticket_ids),
+                return_exceptions=True,
             )
-            if candidate_page:
-                ticket_ids = await extract_ticket_ids(candidate_page)
-
-                agent_last_reply_tickets = []
-                total_processed = 0
-                for ticket_id in ticket_ids:
-                    ticket_data, ticket_page = await extract_ticket_data(
-                        context, ticket_id
+            if any(isinstance(result, SessionExpiredError) for result in results):
+                # The close tabs would be logged out as well
+                await service.invalidate()
+                return
+
+            agent_last_reply_tickets = []
+            total_processed = 0
+            for ticket_id, ticket_data in zip(ticket_ids, results):
+                if isinstance(ticket_data, Exception):
+                    logger.error(
+                        f"Error processing ticket {ticket_id}: {str(ticket_data)}"
                     )
-                    if ticket_data:
-                        if check_last_reply(ticket_data):
-                            agent_last_reply_tickets.append(ticket_id)
-                            await close_ticket(ticket_page, ticket_id)
-                        total_processed += 1
-                    if ticket_page and not ticket_page.is_closed():
-                        await ticket_page.close()
-
-                print("\nTicket IDs where agent was last to reply and were closed:")
-                for ticket_id in agent_last_reply_tickets:
-                    print(ticket_id)
-
-                print(
-                    f"\nTotal tickets where agent was last to reply and were closed: {len(agent_last_reply_tickets)}"
-                )
-                print(f"Total tickets processed: {total_processed}")
-
-        except Exception as e:
-            logger.error(f"An unexpected error occurred: {str(e)}")
-        finally:
-            await browser.close()
+                    continue
+                if ticket_data:
+                    if check_last_reply(ticket_data):
+                        agent_last_reply_tickets.append(ticket_id)
+                    total_processed += 1
+
+            async with pool.page() as close_page:
+                await close_tickets(close_page, agent_last_reply_tickets)
+
+            print("\nTicket IDs where agent was last to reply and were closed:")
+            for ticket_id in agent_last_reply_tickets:
+                print(ticket_id)
+
+            print(
+                f"\nTotal tickets where agent was last to reply and were closed: {len(agent_last_reply_tickets)}"
+            )
+            print(f"Total tickets processed: {total_processed}")
+    finally:
+        if pool is not None:
+            await pool.close()
+        # Already closed if the context was invalidated
+        if candidate_page is not None and not candidate_page.is_closed():
+            await candidate_page.close()
+
+
+async def main():
+    service = await BrowserService().start()
+    await service.serve(run_close)
 
 
 if __name__ == "__main__":
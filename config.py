@@ -3,9 +3,48 @@ import os
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 JSON_OUTPUT_DIR = os.path.join(BASE_DIR, "json")
+# Saved login session, reused across runs until the server expires it
+AUTH_STATE_FILE = os.path.join(BASE_DIR, "auth.json")
 MAX_RETRIES = 10
-RETRY_DELAY = 5
+# Seconds; navigation retries back off exponentially from RETRY_DELAY
+RETRY_DELAY = 0.25
+RETRY_MAX_DELAY = 2.0
 MAX_PARALLEL_TABS = 3
-SAVE_INTERVAL = 3
+# Ticket page loads per second across all tabs
+TICKET_REQUEST_RATE = 5
 MINIMUM_MESSAGE_LENGTH = 1
 API_CALL_LIMIT = 10
+# Milliseconds to wait for a loaded ticket's tables or timeline
+TICKET_CONTENT_TIMEOUT = 15000
+# Gemini requests allowed in flight at once in the async batch path
+MAX_PARALLEL_LLM = 5
+TICKET_URL = "https://support.jamb.gov.ng/agent/candidates-tickets/show/{}"
+PAGE_RECYCLE_INTERVAL = 50
+VIEWPORT = {"width": 1280, "height": 800}
+# Headless Chromium flags that trim per-tab memory and background work
+CHROMIUM_ARGS = [
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--disable-background-networking",
+    "--disable-extensions",
+    "--disable-features=TranslateUI",
+    "--disable-renderer-backgrounding",
+    "--mute-audio",
+]
+# Seconds a single ticket scrape may take before it is abandoned
+TICKET_TIMEOUT = 180
+# Log every Nth processed ticket in full (redacted)
+SAMPLE_LOG_INTERVAL = 10
+# Default number of tickets TicketWriter buffers per write to the daily file
+TICKET_WRITE_BATCH = 64
+# Milliseconds; a ticket page that isn't up by then is retried instead
+NAVIGATION_TIMEOUT = 5000
+TICKET_HEADER_TIMEOUT = 8000
+# Seconds before a long-lived browser context is replaced with a fresh login
+CONTEXT_MAX_AGE = 6 * 60 * 60
+# Environment variable with the seconds between runs when a script is kept
+# alive as a service; unset or 0 runs once. Read at run time, after .env.
+RUN_INTERVAL_ENV = "JAMB_RUN_INTERVAL"
+# Generated replies kept for reuse by identical prompts
+REPLY_CACHE_SIZE = 1024
+REPLY_CACHE_TTL = 24 * 60 * 60
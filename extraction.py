@@ -1,24 +1,49 @@
 # extraction.py
 
-import asyncio
-import random
+from functools import lru_cache
+from selectolax.lexbor import LexborHTMLParser
+from config import TICKET_CONTENT_TIMEOUT, TICKET_URL
 from logger import StructuredLogger
+from login import SessionExpiredError, is_login_url
 from validation import validate_message, validate_ticket_data
-from navigation import navigate_to_ticket_page
-from utils import redact_sensitive_info
-from validation import validate_message, validate_ticket_data
-import json
+from navigation import navigate_to_ticket_page, ticket_request_bucket
 
 logger = StructuredLogger(__name__)
 
+TICKET_CONTENT_SELECTOR = ".timeline-item, .row .table"
+
+
+TICKETS_TABLE_SELECTOR = "table#DataTables_Table_0"
+
+# Reads the ID column from the DataTables instance's own data rather than
+# the rendered rows. Falls back to the DOM when the table isn't a
+# client-side DataTable, since a server-side one only holds its current page.
+TICKET_IDS_JS = """
+(table) => {
+    const dataTable = window.jQuery?.fn?.dataTable;
+    if (dataTable?.isDataTable(table)) {
+        const api = window.jQuery(table).DataTable();
+        if (!api.settings()[0].oFeatures.bServerSide) {
+            // A template parses the cell HTML without loading anything
+            const cell = document.createElement("template");
+            return api.column(0).data().toArray().map((html) => {
+                cell.innerHTML = String(html);
+                return cell.content.textContent.trim();
+            }).filter(Boolean);
+        }
+    }
+    return Array.from(
+        table.querySelectorAll("tbody tr td:first-child a"),
+        (link) => link.textContent.trim()
+    );
+}
+"""
+
 
 async def extract_ticket_ids(page):
     try:
-        await page.wait_for_selector("table#DataTables_Table_0")
-        ticket_ids = await page.eval_on_selector_all(
-            "table#DataTables_Table_0 tbody tr td:first-child a",
-            "elements => elements.map(el => el.textContent.trim())",
-        )
+        table = await page.wait_for_selector(TICKETS_TABLE_SELECTOR)
+        ticket_ids = await table.evaluate(TICKET_IDS_JS)
         logger.info(f"Extracted {len(ticket_ids)} Ticket IDs")
         return ticket_ids
     except Exception as e:
@@ -26,158 +51,281 @@ async def extract_ticket_ids(page):
         return []
 
 
-async def extract_ticket_info(page):
-    try:
-        await page.wait_for_selector(".row .table", state="visible", timeout=60000)
-
-        ticket_info = {}
-
-        # Extract information from the first table
-        first_table = await page.query_selector(".row .col-md-6:first-child .table")
-        rows = await first_table.query_selector_all("tr")
-        for row in rows:
-            th = await row.query_selector("th")
-            td = await row.query_selector("td")
-            key = (await th.inner_text()).strip().lower().replace("/", "_")
-            value = (await td.inner_text()).strip()
-            ticket_info[key] = value
-
-        # Extract information from the second table
-        second_table = await page.query_selector(".row .col-md-6:last-child .table")
-        rows = await second_table.query_selector_all("tr")
-        for row in rows:
-            th = await row.query_selector("th")
-            td = await row.query_selector("td")
-            key = (await th.inner_text()).strip().lower().replace(" ", "_")
-            value = (await td.inner_text()).strip()
-            ticket_info[key] = value
-
-        # Rename keys to match the desired output format
-        key_mapping = {
-            "reference": "ticket_id",
-            "from": "sender_name",
-            "email": "sender_email",
-            "phone": "sender_phone",
-            "assigned_to": "agent_name",
-        }
-        for old_key, new_key in key_mapping.items():
-            if old_key in ticket_info:
-                ticket_info[new_key] = ticket_info.pop(old_key)
+TIMELINE_ITEM_SELECTOR = ".timeline-item"
+MESSAGE_FIELD_SELECTORS = {
+    "sender": ".timeline-header a",
+    "timestamp": ".time",
+    "content": ".timeline-body",
+    "header": ".timeline-header",
+}
 
-        logger.info(
-            f"Successfully extracted info for ticket {ticket_info.get('ticket_id', 'Unknown')}"
-        )
-        return ticket_info
-    except Exception as e:
-        logger.error(f"Failed to extract ticket info: {str(e)}")
-        return {}
+# Headers that are renamed to match the desired output format
+TICKET_INFO_KEYS = {
+    "reference": "ticket_id",
+    "from": "sender_name",
+    "email": "sender_email",
+    "phone": "sender_phone",
+    "assigned to": "agent_name",
+    "assigned_to": "agent_name",
+}
+
+
+@lru_cache(maxsize=256)
+def ticket_info_key(header, separator):
+    """Map a table header to its output key.
+
+    The same handful of headers appear on every ticket, so results are
+    memoized rather than re-normalized per row.
+    """
+    raw = header.strip().lower()
+    return TICKET_INFO_KEYS.get(raw) or raw.replace(separator, "_")
+
+
+def build_ticket_info(first_rows, second_rows):
+    """Build the ticket info dict from the (header, value) rows of both tables."""
+    ticket_info = {}
+
+    # The first table uses "/" in its headers, the second uses spaces
+    for rows, separator in ((first_rows, "/"), (second_rows, " ")):
+        for header, value in rows:
+            if header is None or value is None:
+                continue
+            ticket_info[ticket_info_key(header, separator)] = value.strip()
 
+    return ticket_info
 
+
+@lru_cache(maxsize=1024)
 def normalize_name(name):
     """Normalize a name by removing extra spaces and converting to lowercase."""
     return " ".join(name.lower().split())
 
 
-async def extract_messages(page, original_sender):
-    try:
-        await page.wait_for_selector(".timeline-item", state="visible", timeout=60000)
-        messages = []
-        message_elements = await page.query_selector_all(".timeline-item")
-        original_sender_normalized = normalize_name(original_sender)
-
-        for element in message_elements:
-            try:
-                sender_element = await element.query_selector(".timeline-header a")
-                sender = (
-                    await sender_element.inner_text()
-                    if sender_element
-                    else "Unknown Sender"
-                )
-
-                timestamp_element = await element.query_selector(".time")
-                timestamp = (
-                    await timestamp_element.inner_text()
-                    if timestamp_element
-                    else "Unknown Time"
-                )
-
-                content_element = await element.query_selector(".timeline-body")
-                content = (
-                    await content_element.inner_text()
-                    if content_element
-                    else "No content"
-                )
-                content = content.strip()
-
-                header_element = await element.query_selector(".timeline-header")
-                header_text = (
-                    await header_element.inner_text() if header_element else ""
-                )
-                message_type = "sent" if "sent" in header_text else "replied"
-
-                # Determine if the sender is the original sender or an agent
-                if normalize_name(sender) == original_sender_normalized:
-                    sender_type = "sender_name"
-                else:
-                    sender_type = "agent_name"
-
-                message = {
-                    sender_type: sender,
-                    "timestamp": timestamp,
-                    "content": content,
-                    "type": message_type,
-                }
-
-                logger.info(f"Validating message: {message}")
-                if validate_message(message):
-                    messages.append(message)
-                    logger.info(f"Message added to valid messages: {message}")
-                else:
-                    logger.warning(f"Invalid message skipped: {message}")
-
-            except Exception as inner_e:
-                logger.warning(f"Failed to extract a message: {str(inner_e)}")
-
-        if not messages:
-            logger.warning("No valid messages were extracted from the ticket")
+def build_messages(items, original_sender):
+    """Build and validate message dicts from raw timeline items.
+
+    Each item has "sender", "timestamp", "content" and "header" entries,
+    which are None when the element was missing from the timeline item.
+    """
+    original_sender_normalized = normalize_name(original_sender)
+    messages = []
+
+    for item in items:
+        sender = item["sender"] or "Unknown Sender"
+        content = (item["content"] or "No content").strip()
+        header_text = item["header"] or ""
+        message_type = "sent" if "sent" in header_text else "replied"
+
+        # Determine if the sender is the original sender or an agent
+        if normalize_name(sender) == original_sender_normalized:
+            sender_type = "sender_name"
         else:
-            logger.info(f"Extracted {len(messages)} valid messages")
+            sender_type = "agent_name"
 
-        return messages
-    except Exception as e:
-        logger.error(f"Failed to extract messages: {str(e)}")
-        return []
+        message = {
+            sender_type: sender,
+            "timestamp": item["timestamp"] or "Unknown Time",
+            "content": content,
+            "type": message_type,
+        }
 
+        logger.debug("Validating message: %r", message)
+        if validate_message(message):
+            messages.append(message)
+            logger.debug("Message added to valid messages: %r", message)
+        else:
+            logger.warning(
+                "Invalid message skipped", extra={"timeline_message": message}
+            )
+
+    if not messages:
+        logger.warning("No valid messages were extracted from the ticket")
+    else:
+        logger.info(f"Extracted {len(messages)} valid messages")
+
+    return messages
 
-async def process_ticket(context, ticket_id, processed_tickets):
-    page = await context.new_page()
+
+async def extract_ticket_data(page):
+    """Extract ticket info and validated messages from a loaded ticket page.
+
+    The page's HTML is read once and parsed with selectolax, the same as
+    an HTTP-fetched ticket. Returns None if the page has no ticket content
+    or extraction fails.
+    """
     try:
-        if await navigate_to_ticket_page(page, ticket_id):
-            ticket_info = await extract_ticket_info(page)
-            all_messages = await extract_messages(
-                page, ticket_info.get("sender_name", "")
+        await page.wait_for_selector(
+            TICKET_CONTENT_SELECTOR, state="visible", timeout=TICKET_CONTENT_TIMEOUT
+        )
+        return parse_ticket_html(await page.content())
+    except Exception as e:
+        logger.error(f"Failed to extract ticket data: {str(e)}")
+        return None
+
+
+def _node_text(node):
+    """Approximate innerText for a table cell or header: collapsed whitespace."""
+    return " ".join(node.text().split()) if node is not None else None
+
+
+def parse_ticket_info(tree):
+    """Parse the ticket info tables from server-rendered ticket HTML."""
+    return build_ticket_info(
+        *(
+            [
+                (_node_text(row.css_first("th")), _node_text(row.css_first("td")))
+                for row in tree.css(selector)
+            ]
+            for selector in (
+                ".row .col-md-6:first-child .table tr",
+                ".row .col-md-6:last-child .table tr",
             )
+        )
+    )
+
+
+# Elements that start a new line in rendered text; everything else is inline
+BLOCK_TAGS = frozenset(
+    "address article blockquote dd div dl dt figure footer h1 h2 h3 h4 h5 h6 "
+    "header hr li ol p pre section table tr ul".split()
+)
+SKIPPED_TAGS = frozenset({"-comment", "script", "style", "template"})
+
 
-            # Filter out invalid messages
-            valid_messages = [msg for msg in all_messages if validate_message(msg)]
+def _content_text(node):
+    """Approximate innerText for a message body.
 
-            ticket_data = {**ticket_info, "messages": valid_messages}
+    Inline runs such as `Hello <b>John</b>,` stay on one line; block
+    elements and <br> start a new one. Whitespace is collapsed within each
+    line and blank lines are dropped.
+    """
+    lines = [[]]
 
-            if not valid_messages:
-                ticket_data["needs_review"] = True
-                logger.warning(
-                    f"Ticket {ticket_id} has no valid messages and needs review"
-                )
+    def walk(parent):
+        for child in parent.iter(include_text=True):
+            tag = child.tag
+            if tag == "-text":
+                lines[-1].append(child.text(deep=False))
+            elif tag == "br":
+                lines.append([])
+            elif tag in BLOCK_TAGS:
+                lines.append([])
+                walk(child)
+                lines.append([])
+            elif tag not in SKIPPED_TAGS:
+                walk(child)
 
-            if validate_ticket_data(ticket_data):
-                processed_tickets.append(ticket_data)
-                logger.info(f"Successfully processed ticket {ticket_id}")
+    walk(node)
+    return "\n".join(
+        line for line in (" ".join("".join(parts).split()) for parts in lines) if line
+    )
+
+
+def parse_messages(tree, original_sender):
+    """Parse and validate the timeline messages from server-rendered ticket HTML."""
+    items = []
+    for node in tree.css(TIMELINE_ITEM_SELECTOR):
+        item = {}
+        for field, selector in MESSAGE_FIELD_SELECTORS.items():
+            field_node = node.css_first(selector)
+            if field == "content" and field_node is not None:
+                item[field] = _content_text(field_node)
             else:
-                logger.warning(f"Invalid ticket data for ticket ID: {ticket_id}")
+                item[field] = _node_text(field_node)
+        items.append(item)
+    return build_messages(items, original_sender)
+
+
+def parse_ticket_html(html):
+    """Parse ticket info and validated messages from ticket page HTML.
+
+    Returns None if the HTML has no ticket content.
+    """
+    tree = LexborHTMLParser(html)
+    if tree.css_first(TICKET_CONTENT_SELECTOR) is None:
+        return None
+
+    ticket_info = parse_ticket_info(tree)
+    logger.info(
+        f"Successfully extracted info for ticket {ticket_info.get('ticket_id', 'Unknown')}"
+    )
+    ticket_info["messages"] = parse_messages(tree, ticket_info.get("sender_name", ""))
+    return ticket_info
+
+
+async def fetch_ticket_data(context, ticket_id):
+    """Fetch and parse a ticket page over plain HTTP.
+
+    Uses the context's request client, which shares the logged-in session
+    cookies, so no browser tab is needed. Returns None when the response
+    isn't a rendered ticket page, so callers can fall back to Playwright.
+    Raises SessionExpiredError when redirected to the login form, since the
+    tabs share the same expired session.
+    """
+    response = None
+    try:
+        await ticket_request_bucket.acquire()
+        response = await context.request.get(TICKET_URL.format(ticket_id))
+        if is_login_url(response.url):
+            raise SessionExpiredError(
+                f"HTTP fetch of ticket {ticket_id} was redirected to the login form"
+            )
+        if not response.ok:
+            logger.warning(
+                f"HTTP fetch of ticket {ticket_id} returned status {response.status}"
+            )
+            return None
+
+        ticket_data = parse_ticket_html(await response.text())
+        if ticket_data is None:
+            logger.warning(f"HTTP fetch of ticket {ticket_id} has no ticket content")
+        return ticket_data
+    except SessionExpiredError:
+        raise
+    except Exception as e:
+        logger.warning(f"HTTP fetch of ticket {ticket_id} failed: {str(e)}")
+        return None
+    finally:
+        # The driver keeps every response body until it is disposed or the
+        # context closes, and the context outlives many runs
+        if response is not None:
+            await response.dispose()
+
+
+async def get_ticket_data(pool, ticket_id):
+    """Ticket info and validated messages for a ticket, or None.
+
+    The ticket page is server-rendered, so plain HTTP usually has it all;
+    a pooled tab is only used when the fetched HTML doesn't.
+    """
+    ticket_data = await fetch_ticket_data(pool.context, ticket_id)
+    if ticket_data is None:
+        async with pool.page() as page:
+            if not await navigate_to_ticket_page(page, ticket_id):
+                logger.warning(f"Failed to navigate to ticket {ticket_id}")
+                return None
+            ticket_data = await extract_ticket_data(page)
+    return ticket_data
+
+
+async def process_ticket(pool, ticket_id, processed_tickets):
+    try:
+        ticket_data = await get_ticket_data(pool, ticket_id)
+        if ticket_data is None:
+            return
+        valid_messages = ticket_data["messages"]
+
+        if not valid_messages:
+            ticket_data["needs_review"] = True
+            logger.warning(f"Ticket {ticket_id} has no valid messages and needs review")
+
+        if validate_ticket_data(ticket_data):
+            processed_tickets.append(ticket_data)
+            logger.info(f"Successfully processed ticket {ticket_id}")
         else:
-            logger.warning(f"Failed to navigate to ticket {ticket_id}")
+            logger.warning(f"Invalid ticket data for ticket ID: {ticket_id}")
+    except SessionExpiredError:
+        # Not a problem with this ticket; the caller has to log in again
+        raise
     except Exception as e:
         logger.error(f"Error processing ticket {ticket_id}: {str(e)}")
-    finally:
-        await page.close()
-        await asyncio.sleep(random.uniform(0.5, 1.5))
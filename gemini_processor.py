@@ -2,20 +2,24 @@
 import os
 import re
 import json
+import orjson
+import textwrap
+import asyncio
+import random
+import heapq
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import time
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Callable, Optional
+from typing import List, Dict, Any, Callable, Optional, Tuple
 from dotenv import load_dotenv
 import google.generativeai as genai
-from tenacity import (
-    retry,
-    stop_after_attempt,
-    wait_exponential,
-    retry_if_exception_type,
-)
+from tenacity import retry, stop_after_attempt, wait_none, retry_if_exception
 from google.api_core.exceptions import ResourceExhausted, InvalidArgument
-from utils import save_single_ticket_to_json
-from config import MAX_RETRIES, RETRY_DELAY, API_CALL_LIMIT
+from google.rpc.error_details_pb2 import RetryInfo
+from utils import TicketWriter, save_single_ticket_to_json
+from llm_cache import LLMCache
+from rate_limit import TokenBucket
+from config import MAX_RETRIES, API_CALL_LIMIT, MAX_PARALLEL_LLM
 from validation import validate_message
 from logger import StructuredLogger
 
@@ -23,34 +27,220 @@ logger = StructuredLogger(__name__)
 
 load_dotenv()
 
+API_KEY_ENV_PREFIX = "GEMINI_API_KEY_"
+# Rate-limit timing uses the monotonic clock, in seconds
+RATE_LIMIT_WINDOW = 60.0
+# How long a key rejected as invalid is left out of rotation
+INVALID_KEY_COOLDOWN = 60 * 60.0
+# Rebuild the key usage heap once lazy deletion leaves it this many times
+# larger than the number of keys
+HEAP_REBUILD_FACTOR = 4
+# A JSON "content" field and its string literal, escapes included
+CONTENT_FIELD_RE = re.compile(r'"content"\s*:\s*("(?:[^"\\]|\\.)*")')
+# "[Some Words]" placeholders left in a reply
+BRACKETED_WORDS_RE = re.compile(r"\[(\w+(?: \w+)*)\]")
+
+# Replies come back as {"content": "..."} JSON instead of free text
+REPLY_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema={
+        "type": "object",
+        "properties": {"content": {"type": "string"}},
+        "required": ["content"],
+    },
+)
+
+# Tickets whose messages are all shorter than this carry nothing to answer
+MIN_ANSWERABLE_MESSAGE_LENGTH = 10
+CANNED_REPLIES = {
+    "empty": (
+        "Hello {sender_name}, Welcome JAMB Support System,\n\n"
+        "We could not find any message in your ticket. Please reply with a "
+        "description of the issue you are facing so we can assist you.\n\n"
+        "Sincerely,\nJAMB Support"
+    ),
+    "brief": (
+        "Hello {sender_name}, Welcome JAMB Support System,\n\n"
+        "Thank you for reaching out. Please reply with more details about "
+        "your issue, including your registration number, so we can assist "
+        "you.\n\n"
+        "Sincerely,\nJAMB Support"
+    ),
+}
+
+# What of a ticket goes into the prompt
+PROMPT_TICKET_FIELDS = ("sender_name", "issue", "service_system", "status")
+PROMPT_MESSAGE_FIELDS = ("sender_name", "agent_name", "timestamp")
+PROMPT_MESSAGE_LIMIT = 5
+PROMPT_MESSAGE_CHARS = 2000
+
+PROMPT_TEMPLATE = textwrap.dedent("""
+    Generate a reply for this support ticket:
+    Ticket: {ticket_json}
+
+    Your response must be in the following format:
+    Hello {sender_name}, Welcome JAMB Support System,
+
+    [Your reply here]
+
+    Sincerely,
+    JAMB Support
+
+    Guidelines:
+    - Friendly, but stern tone.
+    - Address the specific issue in the ticket
+    - Be professional and helpful
+    - Do not use any placeholders, deduce and reply to the best of your ability.
+    - cosider {timestamp} when thinking of reply.
+    - For admission acceptance, confirm it was through JAMB CAPS
+    - Escalate complex issues to appropriate authorities
+    - CAPS: Central Admission Processing System
+    - Ensure the name is included exactly as provided
+    - Don't fabricate; state professionally you'll need to verify.
+    - as much as possible sound human.
+    """)
+
 
 class APIKeyManager:
-    def __init__(self, api_keys: List[str]):
+    def __init__(
+        self, api_keys: List[str], time_func: Callable[[], float] = time.monotonic
+    ):
         self.api_keys = api_keys
+        self.time_func = time_func
         self.current_key_index = 0
-        self.key_usage = {i: 0 for i in range(len(api_keys))}
-        self.last_reset_time = datetime.now()
+        # Per-key timestamps of the calls made within the last RATE_LIMIT_WINDOW,
+        # plus every call in time order so expiries can be applied as they pass
+        self.windows = [deque() for _ in api_keys]
+        self.calls = deque()
+        # (calls in window, key_index) entries; every change pushes a fresh
+        # entry and outdated ones are discarded lazily in _least_used_key
+        self.usage_heap = [(0, i) for i in range(len(api_keys))]
+        self.exhausted_until = {}
+        self.invalid_until = {}
 
     def get_current_key(self) -> str:
         return self.api_keys[self.current_key_index]
 
+    def next_key_index(self) -> int:
+        return (self.current_key_index + 1) % len(self.api_keys)
+
     def rotate_key(self) -> str:
-        self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
+        self.current_key_index = self.next_key_index()
         return self.get_current_key()
 
-    def increment_usage(self):
-        self.key_usage[self.current_key_index] += 1
-        self._check_reset()
+    def _expire(self, now: float):
+        while self.calls and self.calls[0][0] <= now - RATE_LIMIT_WINDOW:
+            _, key_index = self.calls.popleft()
+            self.windows[key_index].popleft()
+            self._push_usage(key_index)
+
+    def _push_usage(self, key_index: int):
+        if len(self.usage_heap) > HEAP_REBUILD_FACTOR * len(self.api_keys):
+            self.usage_heap = [(len(w), i) for i, w in enumerate(self.windows)]
+            heapq.heapify(self.usage_heap)
+        else:
+            heapq.heappush(self.usage_heap, (len(self.windows[key_index]), key_index))
+
+    def _least_used_key(self, skip=()) -> Optional[int]:
+        held = []
+        try:
+            while self.usage_heap:
+                usage, index = self.usage_heap[0]
+                if usage != len(self.windows[index]):
+                    heapq.heappop(self.usage_heap)
+                elif index in skip:
+                    held.append(heapq.heappop(self.usage_heap))
+                else:
+                    return index
+            return None
+        finally:
+            for entry in held:
+                heapq.heappush(self.usage_heap, entry)
+
+    def calls_in_window(self, key_index: int) -> int:
+        self._expire(self.time_func())
+        return len(self.windows[key_index])
+
+    def increment_usage(self, key_index: Optional[int] = None):
+        if key_index is None:
+            key_index = self.current_key_index
+        now = self.time_func()
+        self._expire(now)
+        self.windows[key_index].append(now)
+        self.calls.append((now, key_index))
+        self._push_usage(key_index)
+
+    def mark_exhausted(
+        self, key_index: Optional[int] = None, retry_after: Optional[float] = None
+    ):
+        """Sit a key out for the server's requested retry delay, or for a full
+        rate-limit window if it didn't give one."""
+        if key_index is None:
+            key_index = self.current_key_index
+        if retry_after is None:
+            retry_after = RATE_LIMIT_WINDOW
+        self.exhausted_until[key_index] = self.time_func() + retry_after
+
+    def mark_invalid(self, key_index: int):
+        self.invalid_until[key_index] = self.time_func() + INVALID_KEY_COOLDOWN
+
+    def seconds_until_available(self, key_index: Optional[int] = None) -> float:
+        """Seconds until a key can be used again: its quota window reopens or
+        its invalid-key cooldown ends. 0 if neither applies."""
+        if key_index is None:
+            key_index = self.current_key_index
+        now = self.time_func()
+        available_at = now
+        exhausted_until = self.exhausted_until.get(key_index)
+        if exhausted_until is not None:
+            available_at = max(available_at, exhausted_until)
+        invalid_until = self.invalid_until.get(key_index)
+        if invalid_until is not None:
+            available_at = max(available_at, invalid_until)
+        return available_at - now
+
+    def _unavailable_keys(self) -> Dict[int, float]:
+        """Keys sitting out a quota window or invalid-key cooldown, with the
+        seconds until each is usable again."""
+        return {
+            i: wait
+            for i in self.exhausted_until.keys() | self.invalid_until.keys()
+            if (wait := self.seconds_until_available(i)) > 0
+        }
+
+    def acquire_key(self, limit: int) -> Tuple[Optional[int], float]:
+        """Claim a call on the least-used key that is still under `limit`
+        calls in the last window and isn't exhausted or invalid.
+
+        Returns (key_index, 0) on success, or (None, seconds) to wait before
+        asking again when no key has room; the wait ends exactly when the
+        first slot frees up.
+        """
+        self._expire(self.time_func())
+        unavailable = self._unavailable_keys()
+        key_index = self._least_used_key(skip=unavailable)
+        if key_index is None:
+            if len(self.invalid_until) == len(self.api_keys) and all(
+                i in unavailable for i in self.invalid_until
+            ):
+                raise AllAPIKeysExhaustedError(len(self.api_keys))
+            return None, min(unavailable.values())
+
+        if len(self.windows[key_index]) >= limit:
+            # Every usable key is full; wait for the next call to expire
+            now = self.time_func()
+            return None, min(
+                self.windows[i][0] + RATE_LIMIT_WINDOW - now
+                for i in range(len(self.api_keys))
+                if i not in unavailable
+            )
 
-    def _check_reset(self):
-        current_time = datetime.now()
-        if current_time - self.last_reset_time >= timedelta(minutes=1):
-            self.key_usage = {i: 0 for i in range(len(self.api_keys))}
-            self.last_reset_time = current_time
+        self.increment_usage(key_index)
+        return key_index, 0.0
 
     def get_least_used_key(self) -> str:
-        least_used_index = min(self.key_usage, key=self.key_usage.get)
-        self.current_key_index = least_used_index
+        self._expire(self.time_func())
+        self.current_key_index = self._least_used_key()
         return self.get_current_key()
 
 
@@ -102,27 +292,104 @@ class APIResponseValidationError(CustomException):
         super().__init__(message)
 
 
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """The retry delay a quota error asks for (its RetryInfo detail), if any."""
+    for detail in getattr(error, "details", None) or []:
+        if isinstance(detail, RetryInfo):
+            return detail.retry_delay.seconds + detail.retry_delay.nanos / 1e9
+    return None
+
+
+def is_recoverable_api_error(error: BaseException) -> bool:
+    """Quota and key errors, which another attempt (usually on another key)
+    can get past. Anything else is raised straight to the caller."""
+    if isinstance(error, InvalidArgument):
+        return "API_KEY_INVALID" in str(error)
+    return isinstance(
+        error, (ResourceExhausted, APIKeyInvalidError, RateLimitExceededError)
+    )
+
+
+def raise_all_keys_exhausted(retry_state):
+    processor = retry_state.args[0]
+    raise AllAPIKeysExhaustedError(
+        len(processor.api_key_manager.api_keys)
+    ) from retry_state.outcome.exception()
+
+
+def wait_for_key_recovery(retry_state) -> float:
+    """Wait only as long as the key the retry will use needs, jittered so
+    concurrent callers don't retry in lockstep."""
+    processor = retry_state.args[0]
+    delay = processor._retry_delay(retry_state.outcome.exception())
+    return delay + random.uniform(0, 1) if delay else 0.0
+
+
+def recover_key(retry_state):
+    """Move the processor off the failing key before the retry."""
+    processor = retry_state.args[0]
+    processor._recover_from_error(
+        retry_state.outcome.exception(), retry_state.upcoming_sleep
+    )
+
+
+def retry_api_call(wait, before_sleep=None):
+    """Retry a Gemini call on recoverable errors, MAX_RETRIES attempts in
+    total, then raise AllAPIKeysExhaustedError."""
+    return retry(
+        stop=stop_after_attempt(MAX_RETRIES),
+        wait=wait,
+        before_sleep=before_sleep,
+        retry=retry_if_exception(is_recoverable_api_error),
+        retry_error_callback=raise_all_keys_exhausted,
+    )
+
+
 class GeminiProcessor:
     def __init__(
-        self, time_func: Callable[[], datetime] = datetime.now, env_file: str = None
+        self, time_func: Callable[[], float] = time.monotonic, env_file: str = None
     ):
         if env_file:
             load_dotenv(env_file)
-        self.api_key_manager = APIKeyManager(self._load_api_keys())
-        self.api_call_count = 0
+        self.api_key_manager = APIKeyManager(self._load_api_keys(), time_func)
         self.time_func = time_func
-        self.last_reset_time = self.time_func()
+        # Our own budget of API_CALL_LIMIT calls per RATE_LIMIT_WINDOW,
+        # refilled continuously rather than reset once a window
+        self.rate_limiter = TokenBucket(
+            API_CALL_LIMIT / RATE_LIMIT_WINDOW, API_CALL_LIMIT, time_func
+        )
+        # Bounds in-flight async calls
+        self.call_slots = asyncio.Semaphore(MAX_PARALLEL_LLM)
+        self.models = {}
+        self.configured_key_index = None
+        self.reply_cache = LLMCache(time_func=time_func)
+        self.pending_replies = {}
+        # Writes each batch-run save while the next reply is generated; one
+        # worker keeps the saves in order. Its thread starts on first use.
+        self.save_pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="ticket-save"
+        )
         self.initialize_gemini()
 
+    def close(self):
+        """Wait for pending saves and stop the save thread."""
+        self.save_pool.shutdown(wait=True)
+
     def _load_api_keys(self) -> List[str]:
+        # One pass over the environment; any number of GEMINI_API_KEY_<n>
+        # variables, in numeric order
+        numbered_keys = []
+        for name, key in os.environ.items():
+            if not name.startswith(API_KEY_ENV_PREFIX) or not key:
+                continue
+            suffix = name[len(API_KEY_ENV_PREFIX) :]
+            if suffix.isdigit():
+                numbered_keys.append((int(suffix), key))
+
         keys = []
-        for i in range(1, 11):
-            key = os.getenv(f"GEMINI_API_KEY_{i}")
-            if key:
-                keys.append(key)
-                logger.info(f"Loaded API key {i}")
-            else:
-                logger.warning(f"GEMINI_API_KEY_{i} not found in environment variables")
+        for number, key in sorted(numbered_keys):
+            keys.append(key)
+            logger.info(f"Loaded API key {number}")
 
         if not keys:
             logger.error("No Gemini API keys found in environment variables")
@@ -133,8 +400,7 @@ class GeminiProcessor:
 
     def initialize_gemini(self):
         try:
-            genai.configure(api_key=self.api_key_manager.get_current_key())
-            self.model = genai.GenerativeModel("gemini-1.5-pro")
+            self.model = self._model_for_key(self.api_key_manager.current_key_index)
             logger.info(
                 f"Initialized Gemini with API key {self.api_key_manager.current_key_index + 1}"
             )
@@ -142,123 +408,208 @@ class GeminiProcessor:
             logger.error(f"Failed to initialize Gemini: {str(e)}")
             raise
 
-    def check_rate_limit(self):
-        current_time = self.time_func()
-        if current_time - self.last_reset_time >= timedelta(minutes=1):
-            self.api_call_count = 0
-            self.last_reset_time = current_time
+    def _model_for_key(self, key_index: int):
+        # Keep one model per key: a model binds its client (and channel) to
+        # the configured key on its first call and keeps it, so rotating back
+        # to a key reuses the open connection. Callers must use the model
+        # before yielding to the event loop, so a not-yet-bound model binds
+        # to this key rather than whichever one is configured next.
+        if key_index != self.configured_key_index:
+            genai.configure(api_key=self.api_key_manager.api_keys[key_index])
+            self.configured_key_index = key_index
+        if key_index not in self.models:
+            self.models[key_index] = genai.GenerativeModel(
+                "gemini-1.5-pro", generation_config=REPLY_GENERATION_CONFIG
+            )
+        return self.models[key_index]
 
-        if self.api_call_count >= API_CALL_LIMIT:
+    def check_rate_limit(self):
+        if not self.rate_limiter.try_acquire():
             raise RateLimitExceededError(
                 f"Rate limit of {API_CALL_LIMIT} calls exceeded"
             )
 
-        self.api_call_count += 1
+    def _direct_reply(self, ticket: Dict[str, Any]) -> Optional[str]:
+        """Return a canned reply for tickets with nothing to send to Gemini
+        (no messages, or only very short ones), else None."""
+        messages = ticket.get("messages")
+        if not messages:
+            reason = "empty"
+        elif all(
+            len(msg.get("content", "")) < MIN_ANSWERABLE_MESSAGE_LENGTH
+            for msg in messages
+        ):
+            reason = "brief"
+        else:
+            return None
+
+        logger.info(
+            f"Ticket {ticket.get('ticket_id', 'Unknown')} answered without an API call",
+            extra={"direct_reply": reason, "ticket_id": ticket.get("ticket_id")},
+        )
+        return CANNED_REPLIES[reason].format(
+            sender_name=ticket.get("sender_name", "Candidate")
+        )
+
+    def _prompt_payload(self, ticket: Dict[str, Any]) -> Dict[str, Any]:
+        """The parts of a ticket the model needs: no contact details or
+        scraping metadata, and only the latest, length-capped messages."""
+        payload = {
+            field: ticket[field] for field in PROMPT_TICKET_FIELDS if field in ticket
+        }
+        payload["messages"] = [
+            {
+                **{
+                    field: msg[field] for field in PROMPT_MESSAGE_FIELDS if field in msg
+                },
+                "content": msg.get("content", "")[:PROMPT_MESSAGE_CHARS],
+            }
+            for msg in ticket.get("messages", [])[-PROMPT_MESSAGE_LIMIT:]
+        ]
+        return payload
 
     def construct_prompt(self, ticket: Dict[str, Any]) -> str:
         sender_name = ticket.get("sender_name", "Candidate")
-        timestamp = next(
-            (
-                msg.get("timestamp", "N/A")
-                for msg in ticket["messages"]
-                if msg.get("sender_name") == ticket.get("sender_name", "Candidate")
-            ),
-            "N/A",
+        timestamp = "N/A"
+        for msg in ticket["messages"]:
+            if msg.get("sender_name") == sender_name:
+                timestamp = msg.get("timestamp", "N/A")
+                break
+
+        return PROMPT_TEMPLATE.format(
+            ticket_json=orjson.dumps(self._prompt_payload(ticket)).decode(),
+            sender_name=sender_name,
+            timestamp=timestamp,
         )
 
-        return f"""
-        Generate a reply for this support ticket:
-        Ticket: {json.dumps(ticket)}
-        
-        Your response must be in the following format:
-        Hello {sender_name}, Welcome JAMB Support System,
-
-        [Your reply here]
-
-        Sincerely,
-        JAMB Support
-
-        Guidelines:
-        - Friendly, but stern tone.
-        - Address the specific issue in the ticket
-        - Be professional and helpful
-        - Do not use any placeholders, deduce and reply to the best of your ability.
-        - cosider {timestamp} when thinking of reply.
-        - For admission acceptance, confirm it was through JAMB CAPS
-        - Escalate complex issues to appropriate authorities
-        - CAPS: Central Admission Processing System
-        - Ensure the name is included exactly as provided
-        - Don't fabricate; state professionally you'll need to verify.
-        - as much as possible sound human.
+    @retry_api_call(wait=wait_for_key_recovery, before_sleep=recover_key)
+    def generate_reply(self, prompt: str) -> str:
+        cached = self._cached_reply(prompt)
+        if cached is not None:
+            return cached
+
+        self.check_rate_limit()
+        # Async calls may have configured another key since this one was
+        # selected, so the current key is configured again before the call
+        self.model = self._model_for_key(self.api_key_manager.current_key_index)
+        response = self.model.generate_content(prompt)
+        return self._cache_reply(prompt, self._reply_from_response(response))
+
+    # The next attempt picks another key itself and sleeps in _acquire_key
+    # if none has room, so there is nothing to wait for between attempts.
+    @retry_api_call(wait=wait_none())
+    async def generate_reply_async(self, prompt: str) -> str:
+        """Async variant of generate_reply for concurrent batches.
+
+        Each attempt takes its own key from the pool, so concurrent calls
+        are spread across keys and each key is held to API_CALL_LIMIT calls
+        per window.
         """
+        cached = self._cached_reply(prompt)
+        if cached is not None:
+            return cached
 
-    @retry(
-        stop=stop_after_attempt(MAX_RETRIES),
-        wait=wait_exponential(multiplier=1, min=4, max=120),
-        retry=(
-            retry_if_exception_type(ResourceExhausted)
-            | retry_if_exception_type(APIKeyInvalidError)
-            | retry_if_exception_type(RateLimitExceededError)
-        ),
-    )
-    def generate_reply(self, prompt: str) -> str:
-        for _ in range(MAX_RETRIES):
+        async with self.call_slots:
+            key_index = await self._acquire_key()
             try:
-                self.check_rate_limit()
-                response = self.model.generate_content(prompt)
-                logger.debug(f"Raw response from API: {response.text}")
-                content = self.parse_and_validate_reply(response.text)
-                return self._format_reply(content)
-            except (ResourceExhausted, RateLimitExceededError):
-                logger.warning(
-                    f"Rate limit reached for API key {self.api_key_manager.current_key_index + 1}. Rotating API key and retrying..."
-                )
-                self.api_key_manager.rotate_key()
-                self.initialize_gemini()
-                time.sleep(5)  # 5-second delay before retrying
-            except InvalidArgument as e:
-                if "API_KEY_INVALID" in str(e):
-                    logger.error(
-                        f"API key {self.api_key_manager.current_key_index + 1} is invalid. Rotating to next key."
-                    )
-                    self.api_key_manager.rotate_key()
-                    self.initialize_gemini()
-                else:
-                    logger.error(f"Unexpected InvalidArgument: {str(e)}")
-                    raise
+                model = self._model_for_key(key_index)
+                response = await model.generate_content_async(prompt)
             except Exception as e:
-                logger.error(f"Unexpected error in generate_reply: {str(e)}")
+                self._release_failed_key(e, key_index)
                 raise
+        return self._cache_reply(prompt, self._reply_from_response(response))
+
+    def _cached_reply(self, prompt: str) -> Optional[str]:
+        reply = self.reply_cache.get(prompt)
+        if reply is not None:
+            logger.info("Reusing cached reply for an identical prompt")
+        return reply
+
+    def _cache_reply(self, prompt: str, reply: str) -> str:
+        self.reply_cache.set(prompt, reply)
+        return reply
+
+    async def _acquire_key(self) -> int:
+        """Claim a call on the least-used available key, sleeping until one
+        has room instead of failing the attempt."""
+        while True:
+            key_index, delay = self.api_key_manager.acquire_key(API_CALL_LIMIT)
+            if key_index is not None:
+                return key_index
+            logger.warning(f"No API key has capacity. Retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+    def _release_failed_key(self, error: Exception, key_index: int):
+        """Take a key out of rotation after a quota or auth error so the next
+        attempt picks another one."""
+        if isinstance(error, ResourceExhausted):
+            logger.warning(
+                f"Rate limit reached for API key {key_index + 1}. Using another key..."
+            )
+            self.api_key_manager.mark_exhausted(key_index, retry_after_seconds(error))
+        elif isinstance(error, InvalidArgument) and "API_KEY_INVALID" in str(error):
+            logger.error(f"API key {key_index + 1} is invalid. Using another key...")
+            self.api_key_manager.mark_invalid(key_index)
+        else:
+            logger.error(f"Unexpected error in generate_reply_async: {str(error)}")
+
+    def _reply_from_response(self, response) -> str:
+        logger.debug("Raw response from API: %s", response.text)
+        content = self.parse_and_validate_reply(response.text)
+        return self._format_reply(content)
+
+    def _retry_delay(self, error: Exception) -> float:
+        """Seconds to wait before retrying after a recoverable error (see
+        is_recoverable_api_error), for the key _recover_from_error moves to.
+        Changes no state."""
+        if isinstance(error, RateLimitExceededError):
+            # Our own per-minute budget; a different key doesn't help, so
+            # wait for the next token.
+            return self.rate_limiter.seconds_until_available()
+        if isinstance(error, ResourceExhausted):
+            # A key that hasn't hit its quota this window can be used right away
+            manager = self.api_key_manager
+            next_index = manager.next_key_index()
+            delay = manager.seconds_until_available(next_index)
+            if next_index == manager.current_key_index:
+                # The only key is the one that just ran out
+                retry_after = retry_after_seconds(error)
+                delay = max(
+                    delay, RATE_LIMIT_WINDOW if retry_after is None else retry_after
+                )
+            return delay
+        return 0
+
+    def _recover_from_error(self, error: Exception, delay: float = 0):
+        """Rotate the API key after a recoverable error, before sleeping
+        `delay` seconds and retrying."""
+        if isinstance(error, RateLimitExceededError):
+            logger.warning(
+                f"Rate limit of {API_CALL_LIMIT} calls reached. Retrying in {delay:.1f}s..."
+            )
+            return
+        if isinstance(error, ResourceExhausted):
+            logger.warning(
+                f"Rate limit reached for API key {self.api_key_manager.current_key_index + 1}. Rotating API key and retrying..."
+            )
+            self.api_key_manager.mark_exhausted(retry_after=retry_after_seconds(error))
+            self.api_key_manager.rotate_key()
+            self.initialize_gemini()
+            return
 
-        raise AllAPIKeysExhaustedError(
-            "All API keys exhausted. Unable to generate reply."
+        logger.error(
+            f"API key {self.api_key_manager.current_key_index + 1} is invalid. Rotating to next key."
         )
+        self.api_key_manager.rotate_key()
+        self.initialize_gemini()
 
     def _format_reply(self, content: str) -> str:
-        return re.sub(r"\[(\w+( \w+)*)\]", r"\1", content)
+        return BRACKETED_WORDS_RE.sub(r"\1", content)
 
     def parse_and_validate_reply(self, raw_reply: str) -> str:
         try:
-            logger.debug(f"Raw reply from API: {raw_reply}")
-            cleaned_reply = raw_reply.strip()
-            logger.debug(f"Cleaned reply: {cleaned_reply}")
-
-            if cleaned_reply.startswith("```json"):
-                cleaned_reply = cleaned_reply[7:]
-            if cleaned_reply.endswith("```"):
-                cleaned_reply = cleaned_reply[:-3]
-
-            try:
-                parsed_reply = json.loads(cleaned_reply)
-                if isinstance(parsed_reply, dict) and "content" in parsed_reply:
-                    content = parsed_reply["content"]
-                else:
-                    content = cleaned_reply
-            except json.JSONDecodeError:
-                logger.warning(
-                    "JSON parsing failed, attempting direct content extraction"
-                )
-                content = cleaned_reply
+            logger.debug("Raw reply from API: %s", raw_reply)
+            content = self._reply_content(raw_reply)
 
             if content.startswith("Hello") and "JAMB Support" in content:
                 return content
@@ -271,45 +622,130 @@ class GeminiProcessor:
                 f"Failed to parse and validate reply: {str(e)}"
             )
 
-    def _extract_content_directly(self, text: str) -> Optional[str]:
-        match = re.search(r"Hello.*?JAMB Support.*", text, re.DOTALL)
+    def _reply_content(self, raw_reply: str) -> str:
+        """The reply's content field, parsing the reply once.
+
+        The model is asked for JSON (REPLY_GENERATION_CONFIG), sometimes
+        wrapped in a markdown fence; anything that still doesn't parse falls
+        back to pulling out the content field, or to the raw text.
+        """
+        cleaned_reply = raw_reply.strip()
+        if cleaned_reply.startswith("```"):
+            cleaned_reply = (
+                cleaned_reply.removeprefix("```json").removesuffix("```").strip()
+            )
+
+        try:
+            parsed_reply = json.loads(cleaned_reply)
+        except json.JSONDecodeError:
+            parsed_reply = None
+        if isinstance(parsed_reply, dict) and isinstance(
+            parsed_reply.get("content"), str
+        ):
+            return parsed_reply["content"]
+
+        match = CONTENT_FIELD_RE.search(cleaned_reply)
         if match:
-            return match.group()
-        return None
+            return json.loads(match.group(1))
+        logger.warning("Reply is not JSON, using the raw text as content")
+        return cleaned_reply
+
+    def _record_reply(
+        self,
+        ticket: Dict[str, Any],
+        reply: str,
+        save: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        ticket["next_reply"] = [{"content": reply}]
+        (save or save_single_ticket_to_json)(ticket)
+        logger.info(f"Successfully processed and saved ticket {ticket['ticket_id']}")
+
+    def _record_failure(
+        self,
+        ticket: Dict[str, Any],
+        error: Exception,
+        save: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        if isinstance(error, RateLimitExceededError):
+            logger.warning(
+                f"Rate limit exceeded for ticket {ticket['ticket_id']}: {str(error)}"
+            )
+            ticket["next_reply"] = [
+                {
+                    "content": f"Processing delayed due to rate limiting. Please try again later."
+                }
+            ]
+            return
+
+        logger.error(f"Failed to process ticket {ticket['ticket_id']}: {str(error)}")
+        ticket["next_reply"] = [
+            {
+                "content": f"An error occurred: {str(error)}. This ticket requires manual review."
+            }
+        ]
+        (save or save_single_ticket_to_json)(ticket)
 
     def process_tickets_batch(
         self, tickets: List[Dict[str, Any]]
     ) -> List[Dict[str, Any]]:
         processed_tickets = []
-        for ticket in tickets:
-            try:
-                prompt = self.construct_prompt(ticket)
-                reply = self.generate_reply(prompt)
-                ticket["next_reply"] = [{"content": reply}]
-                save_single_ticket_to_json(ticket)
-                processed_tickets.append(ticket)
-                logger.info(
-                    f"Successfully processed and saved ticket {ticket['ticket_id']}"
-                )
-            except RateLimitExceededError as e:
-                logger.warning(
-                    f"Rate limit exceeded for ticket {ticket['ticket_id']}: {str(e)}"
-                )
-                ticket["next_reply"] = [
-                    {
-                        "content": f"Processing delayed due to rate limiting. Please try again later."
-                    }
-                ]
-                processed_tickets.append(ticket)
-            except Exception as e:
-                logger.error(
-                    f"Failed to process ticket {ticket['ticket_id']}: {str(e)}"
-                )
-                ticket["next_reply"] = [
-                    {
-                        "content": f"An error occurred: {str(e)}. This ticket requires manual review."
-                    }
-                ]
-                save_single_ticket_to_json(ticket)
+        # Each ticket is handed to save_pool as soon as it's processed, so its
+        # write happens while the next reply is generated. A reply costs an
+        # API round trip, which dwarfs one append per ticket.
+        with TicketWriter(batch_size=1, executor=self.save_pool) as writer:
+            for ticket in tickets:
+                try:
+                    reply = self._direct_reply(ticket)
+                    if reply is None:
+                        reply = self.generate_reply(self.construct_prompt(ticket))
+                    self._record_reply(ticket, reply, writer.add)
+                except Exception as e:
+                    self._record_failure(ticket, e, writer.add)
                 processed_tickets.append(ticket)
         return processed_tickets
+
+    def _generate_reply_once(self, prompt: str) -> "asyncio.Future[str]":
+        """Start generate_reply_async for a prompt, or join the call already
+        in flight for an identical one."""
+        key = self.reply_cache.key(prompt)
+        call = self.pending_replies.get(key)
+        if call is None:
+            call = asyncio.ensure_future(self.generate_reply_async(prompt))
+            self.pending_replies[key] = call
+            call.add_done_callback(lambda _: self.pending_replies.pop(key, None))
+        return call
+
+    async def reply_to_ticket(self, ticket: Dict[str, Any]) -> bool:
+        """Generate, attach and save the reply for a single ticket.
+
+        Returns False when generating the reply failed and the ticket only
+        holds a placeholder reply, so callers can retry it later.
+        """
+        try:
+            reply = self._direct_reply(ticket)
+            if reply is None:
+                reply = await self._generate_reply_once(self.construct_prompt(ticket))
+            self._record_reply(ticket, reply)
+        except Exception as e:
+            self._record_failure(ticket, e)
+            return False
+        return True
+
+    async def process_ticket_async(self, ticket: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate, attach and save the reply for a single ticket."""
+        await self.reply_to_ticket(ticket)
+        return ticket
+
+    async def process_tickets_batch_async(
+        self, tickets: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """Generate replies for a batch of tickets concurrently.
+
+        Concurrency is bounded by call_slots; results keep the input order.
+        Tickets with identical prompts share a single API call.
+        """
+        return list(
+            await asyncio.gather(
+                *(self.process_ticket_async(ticket) for ticket in tickets)
+            )
+        )
@@ -0,0 +1,54 @@
+# llm_cache.py
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Callable
+from config import REPLY_CACHE_SIZE, REPLY_CACHE_TTL
+
+
+class LLMCache:
+    """In-process LRU cache of generated replies.
+
+    Keys are the SHA-256 of the prompt, so a ticket that is re-processed (or
+    an identical one under another reference, which the prompt leaves out)
+    reuses the earlier reply instead of spending an API call. Message
+    timestamps are part of the prompt and so of the key, since the reply
+    takes the message time into account.
+    """
+
+    def __init__(
+        self,
+        max_size: int = REPLY_CACHE_SIZE,
+        ttl: float = REPLY_CACHE_TTL,
+        time_func: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.time_func = time_func
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def get(self, prompt: str):
+        key = self.key(prompt)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        reply, stored_at = entry
+        if self.time_func() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return reply
+
+    def set(self, prompt: str, reply: str):
+        key = self.key(prompt)
+        self._entries[key] = (reply, self.time_func())
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
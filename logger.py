@@ -1,6 +1,6 @@
 # logger.py
 import logging
-import json
+import orjson
 from datetime import datetime
 
 
@@ -13,26 +13,36 @@ class StructuredLogger:
         handler.setFormatter(formatter)
         self.logger.addHandler(handler)
 
-    def _log(self, level, message, **kwargs):
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def _log(self, level, message, *args, **kwargs):
+        levelno = getattr(logging, level)
+        if not self.logger.isEnabledFor(levelno):
+            return
+        # Like the stdlib logger, %-style args are only formatted when the
+        # record is actually emitted.
+        if args:
+            message = message % args
         log_data = {
             "timestamp": datetime.now().isoformat(),
             "level": level,
             "message": message,
             **kwargs,
         }
-        self.logger.log(getattr(logging, level), json.dumps(log_data))
+        self.logger.log(levelno, orjson.dumps(log_data).decode())
 
-    def info(self, message, **kwargs):
-        self._log("INFO", message, **kwargs)
+    def info(self, message, *args, **kwargs):
+        self._log("INFO", message, *args, **kwargs)
 
-    def warning(self, message, **kwargs):
-        self._log("WARNING", message, **kwargs)
+    def warning(self, message, *args, **kwargs):
+        self._log("WARNING", message, *args, **kwargs)
 
-    def error(self, message, **kwargs):
-        self._log("ERROR", message, **kwargs)
+    def error(self, message, *args, **kwargs):
+        self._log("ERROR", message, *args, **kwargs)
 
-    def debug(self, message, **kwargs):
-        self._log("DEBUG", message, **kwargs)
+    def debug(self, message, *args, **kwargs):
+        self._log("DEBUG", message, *args, **kwargs)
 
 
 # Create a global instance of StructuredLogger
@@ -1,18 +1,37 @@
 # login.py
 import os
+from functools import lru_cache
 from logger import StructuredLogger
 
 logger = StructuredLogger(__name__)
 
+LOGIN_URL = "https://support.jamb.gov.ng/login"
+
+
+class SessionExpiredError(Exception):
+    """The server sent the login form instead of the page asked for."""
+
+
+def is_login_url(url):
+    return url.split("?", 1)[0].rstrip("/") == LOGIN_URL
+
+
+@lru_cache(maxsize=1)
+def get_credentials():
+    # Read on first login rather than at import, since the scripts load
+    # .env after importing this module
+    return os.getenv("EMAIL"), os.getenv("PASSWORD")
+
 
 async def login_to_support(page):
     try:
-        await page.goto("https://support.jamb.gov.ng/login")
+        await page.goto(LOGIN_URL)
         await page.wait_for_load_state("domcontentloaded")
         await page.wait_for_selector('input#email[type="email"]', state="visible")
 
-        await page.fill('input#email[type="email"]', os.getenv("EMAIL"))
-        await page.fill('input#password[type="password"]', os.getenv("PASSWORD"))
+        email, password = get_credentials()
+        await page.fill('input#email[type="email"]', email)
+        await page.fill('input#password[type="password"]', password)
 
         await page.click('button[type="submit"]')
         await page.wait_for_url("**/tickets**")
@@ -22,3 +41,19 @@ async def login_to_support(page):
     except Exception as e:
         logger.error(f"Login failed: {str(e)}")
         return False
+
+
+async def resume_session(page):
+    """Check whether the page's context still has a logged-in session.
+
+    A logged-in session is redirected from the login page to the tickets
+    page, which is left open as the landing page, as after a login.
+    """
+    try:
+        await page.goto(LOGIN_URL)
+        await page.wait_for_url("**/tickets**", timeout=10000)
+        logger.info("Resumed saved login session")
+        return True
+    except Exception as e:
+        logger.info(f"Saved login session is no longer valid: {str(e)}")
+        return False
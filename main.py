@@ -1,54 +1,148 @@
 # main.py
 import os
-import json
 import asyncio
-from datetime import datetime
+import logging
+from collections import deque
 from dotenv import load_dotenv
 from playwright.async_api import async_playwright
 
-from config import JSON_OUTPUT_DIR, MAX_PARALLEL_TABS, SAVE_INTERVAL
-from login import login_to_support
+from config import (
+    CHROMIUM_ARGS,
+    JSON_OUTPUT_DIR,
+    MAX_PARALLEL_TABS,
+    MAX_PARALLEL_LLM,
+    SAMPLE_LOG_INTERVAL,
+    TICKET_TIMEOUT,
+)
 from navigation import navigate_to_candidate_open_tickets_page
 from extraction import extract_ticket_ids, process_ticket
-from utils import save_to_json, ensure_directory_exists
-from logger import StructuredLogger
-from gemini_processor import (
-    GeminiProcessor,
-    AllAPIKeysExhaustedError,
-    RateLimitExceededError,
+from browser import ContextPool, open_logged_in_context
+from login import SessionExpiredError
+from utils import (
+    save_to_json,
+    ensure_directory_exists,
+    to_pretty_json,
+    redact_sensitive_info,
+    append_to_jsonl,
+    load_jsonl,
 )
+from logger import StructuredLogger
+from gemini_processor import GeminiProcessor
 
 logger = StructuredLogger(__name__)
 load_dotenv()
 
 
-async def process_tickets_with_gemini(tickets, processor):
-    logger.info(f"Processing {len(tickets)} tickets with Gemini")
+class Checkpoint:
+    """Persist each ticket to the JSON Lines file as soon as it is replied to.
+
+    The file is the only record of progress: on resume, tickets whose IDs it
+    already holds are skipped, however the listing is ordered this time.
+    Nothing already saved is written again; the full JSON snapshot is only
+    written once the run finishes.
+    """
+
+    def __init__(self, processed_file, processed_tickets):
+        self.processed_file = processed_file
+        self.processed_tickets = processed_tickets
+        self.processed_ids = {ticket.get("ticket_id") for ticket in processed_tickets}
+
+    def pending(self, ticket_ids):
+        """The listed IDs not yet processed, in listing order, without repeats."""
+        seen = set(self.processed_ids)
+        pending = deque()
+        for ticket_id in ticket_ids:
+            if ticket_id not in seen:
+                seen.add(ticket_id)
+                pending.append(ticket_id)
+        return pending
+
+    def complete(self, ticket):
+        self.processed_tickets.append(ticket)
+        self.processed_ids.add(ticket.get("ticket_id"))
+        append_to_jsonl([ticket], self.processed_file)
+
+
+async def scrape_worker(pool, pending, queue):
+    """Scrape queued tickets and hand each scraped one to the repliers."""
+    while pending:
+        ticket_id = pending.popleft()
+        scraped = []
+        try:
+            # A hung page shouldn't hold up the tickets queued behind it
+            await asyncio.wait_for(
+                process_ticket(pool, ticket_id, scraped), TICKET_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Timed out scraping ticket {ticket_id}")
+        except SessionExpiredError:
+            # Every other tab is logged out too. Stop scraping and let the
+            # repliers finish what's queued; the next run logs in afresh and
+            # resumes from the checkpoint.
+            logger.error(
+                f"Session expired while scraping ticket {ticket_id}, "
+                f"abandoning the {len(pending)} tickets still queued"
+            )
+            pending.clear()
+            return
+        if scraped:
+            await queue.put(scraped[0])
+
+
+async def reply_worker(queue, processor, checkpoint):
+    """Generate replies for scraped tickets until a None sentinel arrives."""
+    while (ticket := await queue.get()) is not None:
+        # Tickets left with a placeholder reply aren't checkpointed, so the
+        # next run retries them
+        if not await processor.reply_to_ticket(ticket):
+            logger.warning(
+                f"Reply failed for ticket {ticket.get('ticket_id', 'Unknown')}, "
+                "leaving it for the next run"
+            )
+            continue
+        checkpoint.complete(ticket)
+        logger.info(f"Processed ticket {ticket.get('ticket_id', 'Unknown')}")
+        # Only a redacted sample is dumped; every ticket is in processed.jsonl
+        sampled = len(checkpoint.processed_tickets) % SAMPLE_LOG_INTERVAL == 0
+        if sampled and logger.isEnabledFor(logging.INFO):
+            logger.info(
+                f"Sample ticket: {to_pretty_json(redact_sensitive_info(ticket))}"
+            )
+
+
+async def run_pipeline(pool, pending, processor, checkpoint):
+    """Scrape the pending tickets and reply to them as they come in."""
+    queue = asyncio.Queue(maxsize=MAX_PARALLEL_TABS * 2)
+
+    async def scrape_all():
+        await asyncio.gather(
+            *(scrape_worker(pool, pending, queue) for _ in range(MAX_PARALLEL_TABS))
+        )
+        for _ in range(MAX_PARALLEL_LLM):
+            await queue.put(None)
+
+    tasks = [asyncio.create_task(scrape_all())] + [
+        asyncio.create_task(reply_worker(queue, processor, checkpoint))
+        for _ in range(MAX_PARALLEL_LLM)
+    ]
     try:
-        processed_tickets = processor.process_tickets_batch(tickets)
-        logger.info(f"Finished processing {len(processed_tickets)} tickets with Gemini")
-        return processed_tickets
-    except AllAPIKeysExhaustedError:
-        logger.error("All API keys exhausted. Unable to process tickets.")
-        return tickets
-    except RateLimitExceededError:
-        logger.warning("Rate limit exceeded. Waiting before retrying.")
-        await asyncio.sleep(60)  # Wait for 1 minute before retrying
-        return await process_tickets_with_gemini(tickets, processor)
+        await asyncio.gather(*tasks)
+    finally:
+        # If one side fails, the other would wait forever on the queue
+        for task in tasks:
+            task.cancel()
 
 
 async def main():
     ensure_directory_exists(JSON_OUTPUT_DIR)
     processed_tickets = []
-    resume_from = 0
 
-    progress_file = os.path.join(JSON_OUTPUT_DIR, "scraping_progress.json")
-    if os.path.exists(progress_file):
-        with open(progress_file, "r") as f:
-            progress_data = json.load(f)
-            processed_tickets = progress_data["processed_tickets"]
-            resume_from = progress_data["next_ticket_index"]
-        logger.info(f"Resuming from ticket index {resume_from}")
+    # Processed tickets are appended to a JSON Lines file as they complete,
+    # and a later run picks up from whatever it holds
+    processed_file = os.path.join(JSON_OUTPUT_DIR, "processed.jsonl")
+    if os.path.exists(processed_file):
+        processed_tickets = list(load_jsonl(processed_file))
+        logger.info(f"Resuming with {len(processed_tickets)} tickets already processed")
 
     try:
         processor = GeminiProcessor(env_file=".env")
@@ -57,12 +151,10 @@ async def main():
         return
 
     async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(viewport={"width": 1920, "height": 1080})
-        page = await context.new_page()
-
+        browser = await p.chromium.launch(headless=True, args=CHROMIUM_ARGS)
         try:
-            if not await login_to_support(page):
+            context, page = await open_logged_in_context(browser)
+            if context is None:
                 return
 
             candidate_page = await navigate_to_candidate_open_tickets_page(
@@ -70,56 +162,29 @@ async def main():
             )
             if candidate_page:
                 ticket_ids = await extract_ticket_ids(candidate_page)
-
-                for i in range(resume_from, len(ticket_ids), MAX_PARALLEL_TABS):
-                    batch = ticket_ids[i : i + MAX_PARALLEL_TABS]
-                    logger.info(f"Starting to process batch of {len(batch)} tickets")
-                    tasks = [
-                        process_ticket(context, ticket_id, processed_tickets)
-                        for ticket_id in batch
-                    ]
-                    await asyncio.gather(*tasks)
-
-                    logger.info(
-                        f"Processed {i + len(batch)} out of {len(ticket_ids)} tickets"
-                    )
-
-                    processed_last_batch = await process_tickets_with_gemini(
-                        processed_tickets[-len(batch) :], processor
-                    )
-                    processed_tickets[-len(batch) :] = processed_last_batch
-
-                    for ticket in processed_last_batch:
-                        logger.info(f"Processed ticket: {json.dumps(ticket, indent=2)}")
-
-                    if (i + len(batch)) % SAVE_INTERVAL == 0:
-                        save_to_json(processed_tickets)
-                        with open(progress_file, "w") as f:
-                            json.dump(
-                                {
-                                    "processed_tickets": processed_tickets,
-                                    "next_ticket_index": i + len(batch),
-                                },
-                                f,
-                            )
-                        logger.info(
-                            f"Progress saved. Resumable from ticket index {i + len(batch)}"
-                        )
-
-                    logger.info(f"Finished processing batch of {len(batch)} tickets")
-
-                remaining_tickets = len(processed_tickets) % MAX_PARALLEL_TABS
-                if remaining_tickets > 0:
-                    last_batch = processed_tickets[-remaining_tickets:]
-                    processed_last_batch = await process_tickets_with_gemini(
-                        last_batch, processor
-                    )
-                    processed_tickets[-remaining_tickets:] = processed_last_batch
-
+                # Reuse one warm page per parallel slot, each in its own
+                # context, instead of opening a tab per ticket
+                pool = await ContextPool(context).start()
+                checkpoint = Checkpoint(processed_file, processed_tickets)
+
+                # Scraping and reply generation run as a pipeline: tickets go
+                # to Gemini as soon as they are scraped, while the tabs move
+                # on to the next ones. The bounded queue keeps scraping from
+                # running far ahead of the replies.
+                pending = checkpoint.pending(ticket_ids)
+                logger.info(f"{len(pending)} of {len(ticket_ids)} tickets to process")
+                await run_pipeline(pool, pending, processor, checkpoint)
+
+                logger.info(
+                    f"Processed {len(processed_tickets)} tickets in total, "
+                    f"{len(ticket_ids)} listed"
+                )
                 save_to_json(processed_tickets)
         except Exception as e:
             logger.error(f"An unexpected error occurred: {str(e)}")
         finally:
+            # Join any saves still pending on the processor's save thread
+            processor.close()
             await browser.close()
 
 
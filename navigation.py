@@ -1,10 +1,25 @@
 # navigation.py
-import asyncio
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter
 from logger import StructuredLogger
-from config import MAX_RETRIES, RETRY_DELAY
+from config import (
+    MAX_PARALLEL_TABS,
+    MAX_RETRIES,
+    RETRY_DELAY,
+    RETRY_MAX_DELAY,
+    TICKET_URL,
+    NAVIGATION_TIMEOUT,
+    TICKET_HEADER_TIMEOUT,
+    TICKET_REQUEST_RATE,
+)
+from rate_limit import TokenBucket
 
 logger = StructuredLogger(__name__)
 
+# Shared by every tab so ticket loads are paced globally
+ticket_request_bucket = TokenBucket(TICKET_REQUEST_RATE, MAX_PARALLEL_TABS)
+
+TICKET_HEADER_SELECTOR = 'h1:has-text("Ticket")'
+
 
 async def navigate_to_candidate_open_tickets_page(page, context):
     try:
@@ -29,27 +44,41 @@ async def navigate_to_candidate_open_tickets_page(page, context):
         return None
 
 
-async def navigate_to_ticket_page(page, ticket_id):
-    for attempt in range(MAX_RETRIES):
-        try:
-            url = (
-                f"https://support.jamb.gov.ng/agent/candidates-tickets/show/{ticket_id}"
-            )
-            await page.goto(url)
-            await page.wait_for_load_state("domcontentloaded")
-            await page.wait_for_selector(
-                'h1:has-text("Ticket")', state="visible", timeout=60000
-            )
-            logger.info(f"Navigating to Ticket Page {ticket_id} Successful")
-            return True
-        except Exception as e:
-            logger.warning(
-                f"Attempt {attempt + 1} failed to navigate to ticket {ticket_id}: {str(e)}"
-            )
-            if attempt < MAX_RETRIES - 1:
-                await asyncio.sleep(RETRY_DELAY)
-            else:
-                logger.error(
-                    f"Failed to navigate to ticket {ticket_id} after {MAX_RETRIES} attempts"
-                )
-                return False
+def _log_navigation_retry(retry_state):
+    logger.warning(
+        f"Attempt {retry_state.attempt_number} failed to navigate to ticket "
+        f"{retry_state.args[1]}: {str(retry_state.outcome.exception())}"
+    )
+
+
+def _log_navigation_failure(retry_state):
+    logger.error(
+        f"Failed to navigate to ticket {retry_state.args[1]} "
+        f"after {retry_state.attempt_number} attempts"
+    )
+    return False
+
+
+# Transient failures are retried quickly with exponential backoff; the
+# jitter keeps the tabs from retrying in lockstep
+@retry(
+    stop=stop_after_attempt(MAX_RETRIES),
+    wait=wait_exponential_jitter(
+        initial=RETRY_DELAY, max=RETRY_MAX_DELAY, jitter=RETRY_DELAY * 2
+    ),
+    before_sleep=_log_navigation_retry,
+    retry_error_callback=_log_navigation_failure,
+)
+async def navigate_to_ticket_page(page, ticket_id, wait_until="commit"):
+    # Reading a ticket doesn't wait for the load events; the header showing up
+    # is what matters, and a stalled load is cheaper to retry than to wait out.
+    # Pages that get clicked on need "load" so their handlers are wired up.
+    await ticket_request_bucket.acquire()
+    await page.goto(
+        TICKET_URL.format(ticket_id), wait_until=wait_until, timeout=NAVIGATION_TIMEOUT
+    )
+    await page.wait_for_selector(
+        TICKET_HEADER_SELECTOR, state="visible", timeout=TICKET_HEADER_TIMEOUT
+    )
+    logger.info(f"Navigating to Ticket Page {ticket_id} Successful")
+    return True
@@ -0,0 +1,41 @@
+# rate_limit.py
+import asyncio
+import time
+
+
+class TokenBucket:
+    """A token bucket refilled at `rate` tokens per second, up to `capacity`.
+
+    Shared by all workers, it paces requests globally instead of each worker
+    sleeping on its own. `acquire` waits in FIFO order for a token.
+    """
+
+    def __init__(self, rate, capacity=1, time_func=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.time_func = time_func
+        self.tokens = float(capacity)
+        self.updated = time_func()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.time_func()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take `tokens` if they are available right now."""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def seconds_until_available(self, tokens=1):
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(self.seconds_until_available(tokens))
@@ -1,62 +1,169 @@
 # unit_test.py
-import unittest
-from unittest.mock import patch, MagicMock
-from datetime import datetime, timedelta
+import asyncio
 import json
+import orjson
+import os
+import tempfile
+import unittest
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from unittest.mock import patch, MagicMock, AsyncMock
 from gemini_processor import (
     GeminiProcessor,
+    APIKeyManager,
     APIKeyInvalidError,
     RateLimitExceededError,
     AllAPIKeysExhaustedError,
     APIResponseValidationError,
+    retry_after_seconds,
+    wait_for_key_recovery,
 )
+from llm_cache import LLMCache
 from google.api_core.exceptions import ResourceExhausted, InvalidArgument
+from google.rpc.error_details_pb2 import RetryInfo
 from config import API_CALL_LIMIT, MAX_RETRIES
+import extraction
+from extraction import parse_ticket_html
+import utils
+from browser import BrowserService
+from login import LOGIN_URL, SessionExpiredError
+import check_agent_last_reply
+import close_ticket_agent_reply_last
+from main import Checkpoint, reply_worker, run_pipeline, scrape_worker
+from validation import (
+    REPLY_FORM_MARKERS,
+    REQUIRED_TICKET_FIELDS,
+    has_reply_form_markers,
+    validate_message,
+    validate_ticket_data,
+)
+
+TICKET_PAGE_HTML = """
+<html><body>
+<div class="row">
+  <div class="col-md-6">
+    <table class="table">
+      <tr><th>Reference</th><td> #TEST-001 </td></tr>
+      <tr><th>Status</th><td>Open</td></tr>
+      <tr><th>Service/System</th><td>Registration</td></tr>
+    </table>
+  </div>
+  <div class="col-md-6">
+    <table class="table">
+      <tr><th>From</th><td>John  Doe</td></tr>
+      <tr><th>Email</th><td>john@example.com</td></tr>
+      <tr><th>Phone</th><td>08012345678</td></tr>
+      <tr><th>Assigned To</th><td>Agent Smith</td></tr>
+      <tr><th>Issue</th><td>Change of <b>course</b></td></tr>
+    </table>
+  </div>
+</div>
+<div class="timeline">
+  <div class="timeline-item">
+    <span class="time">2024-01-01 10:00</span>
+    <h3 class="timeline-header"><a href="#">John Doe</a> sent a message</h3>
+    <div class="timeline-body">
+      <p>Hello <b>Support</b>, my reg no is <span>12345</span>.</p>
+      <p>Second para</p>
+    </div>
+  </div>
+  <div class="timeline-item">
+    <span class="time">2024-01-02 09:30</span>
+    <h3 class="timeline-header"><a href="#">Agent Smith</a> replied</h3>
+    <div class="timeline-body">Dear John,<br>Please <i>re-upload</i> it.<br></div>
+  </div>
+</div>
+</body></html>
+"""
+
+REPLY_TEMPLATE = "Hello {name}, JAMB Support here,\n\nThis is a test reply.\n\nSincerely,\nJAMB Support"
+
+
+def make_reply(name):
+    return REPLY_TEMPLATE.format(name=name)
+
+
+def make_reply_json(name):
+    """The reply as Gemini returns it: a JSON object with a content field."""
+    return json.dumps({"content": make_reply(name)})
+
+
+def make_reply_mock(name):
+    return MagicMock(text=make_reply_json(name))
+
+
+class PatchMixin:
+    def start_patch(self, *args, **kwargs):
+        """Start a patch that is undone when the test finishes."""
+        patcher = patch(*args, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
 
 
-class TestGeminiProcessorIntegration(unittest.TestCase):
+class TestGeminiProcessorIntegration(PatchMixin, unittest.TestCase):
     def setUp(self):
-        self.time_func = MagicMock(return_value=datetime(2024, 1, 1, 0, 0, 0))
+        self.time_func = MagicMock(return_value=1000.0)
         self.processor = GeminiProcessor(time_func=self.time_func)
 
+    def tearDown(self):
+        self.processor.close()
+
+    def patch_generate_content(self):
+        return self.start_patch("google.generativeai.GenerativeModel.generate_content")
+
+    def patch_generate_content_async(self):
+        return self.start_patch(
+            "google.generativeai.GenerativeModel.generate_content_async",
+            new_callable=AsyncMock,
+        )
+
     def test_construct_prompt(self):
         test_ticket = {
             "sender_name": "John Doe",
+            "sender_email": "john@example.com",
             "ticket_id": "#TEST-001",
             "messages": [{"content": "Test message"}],
         }
         prompt = self.processor.construct_prompt(test_ticket)
         self.assertIn("Hello John Doe, Welcome JAMB Support System,", prompt)
-        self.assertIn(json.dumps(test_ticket), prompt)
+        self.assertIn(
+            '{"sender_name":"John Doe","messages":[{"content":"Test message"}]}',
+            prompt,
+        )
+        self.assertNotIn("john@example.com", prompt)
 
-    @patch("google.generativeai.GenerativeModel.generate_content")
-    def test_successful_api_call(self, mock_generate_content):
-        mock_generate_content.return_value.text = '{"content": "Hello John, JAMB Support here,\\n\\nThis is a test reply.\\n\\nSincerely,\\nJAMB Support"}'
+    def test_successful_api_call(self):
+        mock_generate_content = self.patch_generate_content()
+        mock_generate_content.return_value.text = make_reply_json("John")
         result = self.processor.generate_reply("Test prompt")
         self.assertIn("Hello John, JAMB Support here", result)
 
-    @patch("google.generativeai.GenerativeModel.generate_content")
-    def test_rate_limit_with_recovery(self, mock_generate_content):
+    def test_rate_limit_with_recovery(self):
+        mock_generate_content = self.patch_generate_content()
         mock_generate_content.side_effect = [
             ResourceExhausted("Rate limit exceeded"),
-            MagicMock(
-                text='{"content": "Hello Jane, JAMB Support here,\\n\\nThis is a test reply.\\n\\nSincerely,\\nJAMB Support"}'
-            ),
+            make_reply_mock("Jane"),
         ]
         result = self.processor.generate_reply("Test prompt")
         self.assertIn("Hello Jane, JAMB Support here", result)
 
-    @patch("google.generativeai.GenerativeModel.generate_content")
-    def test_persistent_api_error(self, mock_generate_content):
+    def test_persistent_api_error(self):
+        mock_generate_content = self.patch_generate_content()
         mock_generate_content.side_effect = [InvalidArgument("API_KEY_INVALID")] * (
             MAX_RETRIES + 1
         )
-        with self.assertRaises(AllAPIKeysExhaustedError):
+        with self.assertRaises(AllAPIKeysExhaustedError) as cm:
             self.processor.generate_reply("Test prompt")
         self.assertEqual(mock_generate_content.call_count, MAX_RETRIES)
+        key_count = len(self.processor.api_key_manager.api_keys)
+        self.assertEqual(cm.exception.total_keys, key_count)
+        self.assertEqual(
+            str(cm.exception), f"All {key_count} API keys have been exhausted"
+        )
 
-    @patch("gemini_processor.save_single_ticket_to_json")
-    def test_process_tickets_batch(self, mock_save):
+    @patch("gemini_processor.TicketWriter")
+    def test_process_tickets_batch(self, mock_writer):
         test_tickets = [
             {
                 "ticket_id": "#TEST-001",
@@ -67,7 +174,7 @@ class TestGeminiProcessorIntegration(unittest.TestCase):
         with patch.object(
             self.processor,
             "generate_reply",
-            return_value="Hello Test User, JAMB Support here,\n\nThis is a test reply.\n\nSincerely,\nJAMB Support",
+            return_value=make_reply("Test User"),
         ):
             processed_tickets = self.processor.process_tickets_batch(test_tickets)
 
@@ -76,6 +183,214 @@ class TestGeminiProcessorIntegration(unittest.TestCase):
             "Hello Test User, JAMB Support here",
             processed_tickets[0]["next_reply"][0]["content"],
         )
+        mock_writer.assert_called_once_with(
+            batch_size=1, executor=self.processor.save_pool
+        )
+        writer = mock_writer.return_value.__enter__.return_value
+        writer.add.assert_called_once_with(processed_tickets[0])
+
+    @patch("gemini_processor.TicketWriter")
+    def test_trivial_tickets_skip_the_api(self, mock_writer):
+        test_tickets = [
+            {"ticket_id": "#TEST-001", "sender_name": "Test User", "messages": []},
+            {
+                "ticket_id": "#TEST-002",
+                "sender_name": "Test User",
+                "messages": [{"content": "Hi"}],
+            },
+        ]
+        with patch.object(self.processor, "generate_reply") as mock_generate_reply:
+            processed_tickets = self.processor.process_tickets_batch(test_tickets)
+
+        mock_generate_reply.assert_not_called()
+        for ticket in processed_tickets:
+            content = ticket["next_reply"][0]["content"]
+            self.assertTrue(content.startswith("Hello Test User"))
+            self.assertIn("JAMB Support", content)
+
+    def test_direct_reply_logs_reason_as_extra(self):
+        with patch("gemini_processor.logger") as mock_logger:
+            self.processor._direct_reply({"ticket_id": "#TEST-001", "messages": []})
+        mock_logger.info.assert_called_once()
+        self.assertEqual(
+            mock_logger.info.call_args.kwargs,
+            {"extra": {"direct_reply": "empty", "ticket_id": "#TEST-001"}},
+        )
+
+    @patch("gemini_processor.save_single_ticket_to_json")
+    def test_process_tickets_batch_async(self, mock_save):
+        test_tickets = [
+            {
+                "ticket_id": f"#TEST-00{i}",
+                "sender_name": "Test User",
+                "messages": [{"content": "Test message"}],
+            }
+            for i in range(1, 4)
+        ]
+        with patch.object(
+            self.processor,
+            "generate_reply_async",
+            new=AsyncMock(return_value=make_reply("Test User")),
+        ) as mock_generate_reply_async:
+            processed_tickets = asyncio.run(
+                self.processor.process_tickets_batch_async(test_tickets)
+            )
+
+        # The prompt leaves out the reference, the only difference between
+        # the tickets, so one call serves all three
+        mock_generate_reply_async.assert_awaited_once()
+
+        self.assertEqual(
+            [ticket["ticket_id"] for ticket in processed_tickets],
+            ["#TEST-001", "#TEST-002", "#TEST-003"],
+        )
+        self.assertEqual(mock_save.call_count, 3)
+
+    @patch("gemini_processor.save_single_ticket_to_json")
+    def test_failed_reply_is_not_checkpointed(self, mock_save):
+        tickets = [
+            {
+                "ticket_id": f"#TEST-00{i}",
+                "sender_name": f"Test User {i}",
+                "messages": [{"content": f"Test message {i}"}],
+            }
+            for i in range(1, 3)
+        ]
+        replies = [make_reply("Test User 1"), RateLimitExceededError(API_CALL_LIMIT)]
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        processed_file = os.path.join(tmp.name, "processed.jsonl")
+        checkpoint = Checkpoint(processed_file, [])
+
+        async def run():
+            queue = asyncio.Queue()
+            for ticket in tickets:
+                queue.put_nowait(ticket)
+            queue.put_nowait(None)
+            await reply_worker(queue, self.processor, checkpoint)
+
+        with patch.object(
+            self.processor,
+            "generate_reply_async",
+            new=AsyncMock(side_effect=replies),
+        ):
+            asyncio.run(run())
+
+        # The rate-limited ticket is left for the next run to retry
+        self.assertEqual(checkpoint.processed_ids, {"#TEST-001"})
+        self.assertEqual(
+            list(checkpoint.pending(["#TEST-001", "#TEST-002"])), ["#TEST-002"]
+        )
+        self.assertIn("rate limiting", tickets[1]["next_reply"][0]["content"])
+
+    def test_failed_replier_stops_the_pipeline(self):
+        async def scrape_forever(pool, pending, queue):
+            await asyncio.Event().wait()
+
+        self.start_patch("main.scrape_worker", new=scrape_forever)
+        self.start_patch(
+            "main.reply_worker", new=AsyncMock(side_effect=RuntimeError("boom"))
+        )
+
+        async def run():
+            await asyncio.wait_for(
+                run_pipeline(MagicMock(), deque(["#TEST-001"]), self.processor, None),
+                timeout=5,
+            )
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(run())
+
+    def test_successful_async_api_call(self):
+        mock_generate_content_async = self.patch_generate_content_async()
+        mock_generate_content_async.return_value = make_reply_mock("John")
+        result = asyncio.run(self.processor.generate_reply_async("Test prompt"))
+        self.assertIn("Hello John, JAMB Support here", result)
+
+    def test_async_call_waits_when_all_keys_are_busy(self):
+        mock_generate_content_async = self.patch_generate_content_async()
+        mock_generate_content_async.return_value = make_reply_mock("John")
+        manager = self.processor.api_key_manager
+        for key_index in range(len(manager.api_keys)):
+            for _ in range(API_CALL_LIMIT):
+                manager.increment_usage(key_index)
+
+        async def advance_clock(delay):
+            self.time_func.return_value += delay
+
+        with patch(
+            "gemini_processor.asyncio.sleep", new=AsyncMock(side_effect=advance_clock)
+        ) as mock_sleep:
+            result = asyncio.run(self.processor.generate_reply_async("Test prompt"))
+
+        mock_sleep.assert_awaited_once_with(60.0)
+        self.assertIn("Hello John, JAMB Support here", result)
+
+    def test_async_calls_spread_across_keys(self):
+        mock_generate_content_async = self.patch_generate_content_async()
+        mock_generate_content_async.return_value = make_reply_mock("John")
+
+        async def run_batch():
+            return await asyncio.gather(
+                self.processor.generate_reply_async("Prompt 1"),
+                self.processor.generate_reply_async("Prompt 2"),
+            )
+
+        asyncio.run(run_batch())
+        manager = self.processor.api_key_manager
+        self.assertEqual([manager.calls_in_window(i) for i in (0, 1)], [1, 1])
+
+    def test_async_invalid_key_is_skipped(self):
+        mock_generate_content_async = self.patch_generate_content_async()
+        mock_generate_content_async.side_effect = [
+            InvalidArgument("API_KEY_INVALID"),
+            make_reply_mock("User"),
+        ]
+        result = asyncio.run(self.processor.generate_reply_async("Test prompt"))
+
+        self.assertIn("Hello User, JAMB Support here", result)
+        self.assertIn(0, self.processor.api_key_manager.invalid_until)
+        manager = self.processor.api_key_manager
+        self.assertEqual([manager.calls_in_window(i) for i in (0, 1)], [1, 1])
+
+    def test_identical_prompt_reuses_cached_reply(self):
+        mock_generate_content = self.patch_generate_content()
+        mock_generate_content.return_value.text = make_reply_json("John")
+        ticket = {
+            "ticket_id": "#TEST-001",
+            "sender_name": "John",
+            "messages": [
+                {"sender_name": "John", "timestamp": "10:00", "content": "Test"}
+            ],
+        }
+        first = self.processor.generate_reply(self.processor.construct_prompt(ticket))
+
+        ticket["ticket_id"] = "#TEST-002"
+        second = self.processor.generate_reply(self.processor.construct_prompt(ticket))
+
+        self.assertEqual(first, second)
+        self.assertEqual(mock_generate_content.call_count, 1)
+
+        # The prompt asks for a reply that considers the message time
+        ticket["messages"][0]["timestamp"] = "11:30"
+        self.processor.generate_reply(self.processor.construct_prompt(ticket))
+        self.assertEqual(mock_generate_content.call_count, 2)
+
+    def test_reply_cache_expiry_and_eviction(self):
+        cache = LLMCache(max_size=2, ttl=60, time_func=self.time_func)
+        cache.set("first", "reply 1")
+        self.time_func.return_value += 30
+        cache.set("second", "reply 2")
+        self.assertEqual(cache.get("first"), "reply 1")
+
+        # "second" is now the least recently used, so it makes room
+        cache.set("third", "reply 3")
+        self.assertIsNone(cache.get("second"))
+        self.assertEqual(len(cache), 2)
+
+        self.time_func.return_value += 31
+        self.assertIsNone(cache.get("first"))
+        self.assertEqual(cache.get("third"), "reply 3")
 
     def test_api_key_rotation(self):
         initial_key_index = self.processor.api_key_manager.current_key_index
@@ -84,13 +399,70 @@ class TestGeminiProcessorIntegration(unittest.TestCase):
             initial_key_index, self.processor.api_key_manager.current_key_index
         )
 
-    @patch("google.generativeai.GenerativeModel.generate_content")
-    def test_api_key_rotation_on_resource_exhausted(self, mock_generate_content):
+    def test_get_least_used_key(self):
+        manager = APIKeyManager(["key-1", "key-2", "key-3"])
+        for index in (0, 0, 1, 2, 2):
+            manager.current_key_index = index
+            manager.increment_usage()
+
+        self.assertEqual(manager.get_least_used_key(), "key-2")
+        self.assertEqual(manager.current_key_index, 1)
+
+        manager.increment_usage()
+        manager.increment_usage()
+        self.assertEqual(manager.get_least_used_key(), "key-1")
+
+    def test_key_usage_slides_with_window(self):
+        manager = APIKeyManager(["key-1", "key-2"], self.time_func)
+        manager.increment_usage(0)
+        self.time_func.return_value += 30
+        manager.increment_usage(0)
+        self.assertEqual(manager.calls_in_window(0), 2)
+
+        self.time_func.return_value += 30
+        self.assertEqual(manager.calls_in_window(0), 1)
+
+    def test_exhausted_key_waits_for_window(self):
+        manager = APIKeyManager(["key-1", "key-2"])
+        self.assertEqual(manager.seconds_until_available(), 0.0)
+
+        manager.mark_exhausted()
+        self.assertGreater(manager.seconds_until_available(), 59)
+
+        manager.rotate_key()
+        self.assertEqual(manager.seconds_until_available(), 0.0)
+
+    def test_exhausted_key_honors_retry_delay(self):
+        manager = APIKeyManager(["key-1", "key-2"], self.time_func)
+        error = ResourceExhausted("Quota exceeded", details=[RetryInfo()])
+        error.details[0].retry_delay.seconds = 12
+        manager.mark_exhausted(retry_after=retry_after_seconds(error))
+        self.assertEqual(manager.seconds_until_available(), 12)
+
+    def test_rotation_reuses_model_per_key(self):
+        first_model = self.processor.model
+        for _ in self.processor.api_key_manager.api_keys:
+            self.processor.api_key_manager.rotate_key()
+            self.processor.initialize_gemini()
+        self.assertIs(self.processor.model, first_model)
+
+    def test_sync_call_uses_current_key_after_async_configure(self):
+        mock_generate_content = self.patch_generate_content()
+        mock_generate_content.return_value = make_reply_mock("Test User")
+        current = self.processor.api_key_manager.current_key_index
+        # An async call configured the other key and left it configured
+        other_model = self.processor._model_for_key(1 - current)
+
+        self.processor.generate_reply("Test prompt")
+
+        self.assertEqual(self.processor.configured_key_index, current)
+        self.assertIsNot(self.processor.model, other_model)
+
+    def test_api_key_rotation_on_resource_exhausted(self):
+        mock_generate_content = self.patch_generate_content()
         mock_generate_content.side_effect = [
             ResourceExhausted("Rate limit exceeded"),
-            MagicMock(
-                text='{"content": "Hello User, JAMB Support here,\\n\\nThis is a test reply.\\n\\nSincerely,\\nJAMB Support"}'
-            ),
+            make_reply_mock("User"),
         ]
         initial_key_index = self.processor.api_key_manager.current_key_index
         result = self.processor.generate_reply("Test prompt")
@@ -99,13 +471,22 @@ class TestGeminiProcessorIntegration(unittest.TestCase):
         )
         self.assertIn("Hello User, JAMB Support here", result)
 
-    @patch("google.generativeai.GenerativeModel.generate_content")
-    def test_api_key_rotation_on_invalid_key(self, mock_generate_content):
+    def test_retry_wait_does_not_rotate_keys(self):
+        retry_state = MagicMock(args=(self.processor,))
+        retry_state.outcome.exception.return_value = ResourceExhausted("Quota")
+        initial_key_index = self.processor.api_key_manager.current_key_index
+
+        # The other key is unused, so the retry can go right away
+        self.assertEqual(wait_for_key_recovery(retry_state), 0.0)
+        self.assertEqual(
+            self.processor.api_key_manager.current_key_index, initial_key_index
+        )
+
+    def test_api_key_rotation_on_invalid_key(self):
+        mock_generate_content = self.patch_generate_content()
         mock_generate_content.side_effect = [
             InvalidArgument("API_KEY_INVALID"),
-            MagicMock(
-                text='{"content": "Hello User, JAMB Support here,\\n\\nThis is a test reply.\\n\\nSincerely,\\nJAMB Support"}'
-            ),
+            make_reply_mock("User"),
         ]
         initial_key_index = self.processor.api_key_manager.current_key_index
         result = self.processor.generate_reply("Test prompt")
@@ -115,28 +496,55 @@ class TestGeminiProcessorIntegration(unittest.TestCase):
         self.assertIn("Hello User, JAMB Support here", result)
 
     def test_rate_limit_reset(self):
-        for _ in range(API_CALL_LIMIT):
+        # Start from an empty bucket instead of making API_CALL_LIMIT calls
+        self.processor.rate_limiter.tokens = 0
+        with self.assertRaises(RateLimitExceededError):
             self.processor.check_rate_limit()
 
         # Simulate 1 minute passing
-        self.time_func.return_value += timedelta(minutes=1)
+        self.time_func.return_value += 60
 
-        # This should not raise an exception as the rate limit should have reset
+        # This should not raise an exception as the bucket has refilled
+        self.processor.check_rate_limit()
+
+    def test_rate_limit_refills_gradually(self):
+        self.processor.rate_limiter.tokens = 0
+        interval = 60 / API_CALL_LIMIT
+
+        self.time_func.return_value += interval / 2
+        with self.assertRaises(RateLimitExceededError):
+            self.processor.check_rate_limit()
+
+        self.time_func.return_value += interval / 2
         self.processor.check_rate_limit()
 
     def test_parse_and_validate_reply_with_json(self):
-        raw_reply = '{"content": "Hello John Doe, JAMB Support here,\\n\\nThis is a test reply.\\n\\nSincerely,\\nJAMB Support"}'
+        raw_reply = make_reply_json("John Doe")
         result = self.processor.parse_and_validate_reply(raw_reply)
         self.assertEqual(
             result,
-            "Hello John Doe, JAMB Support here,\n\nThis is a test reply.\n\nSincerely,\nJAMB Support",
+            make_reply("John Doe"),
         )
 
     def test_parse_and_validate_reply_with_markdown(self):
-        raw_reply = '```json\n{"content": "Hello User, JAMB Support here,\\n\\nThis is a test reply.\\n\\nSincerely,\\nJAMB Support"}\n```'
+        raw_reply = f"```json\n{make_reply_json('User')}\n```"
         result = self.processor.parse_and_validate_reply(raw_reply)
         self.assertIn("Hello User, JAMB Support here", result)
 
+    def test_parse_and_validate_fenced_reply_parses_once(self):
+        raw_reply = f"```json\n{make_reply_json('User')}\n```"
+        with patch("gemini_processor.json.loads", wraps=json.loads) as mock_loads:
+            result = self.processor.parse_and_validate_reply(raw_reply)
+        self.assertEqual(result, make_reply("User"))
+        mock_loads.assert_called_once()
+
+    def test_parse_and_validate_reply_with_escaped_quotes(self):
+        raw_reply = '{"content": "Hello \\"Ada\\", JAMB Support here,\\n\\nSincerely,\\nJAMB Support"}'
+        result = self.processor.parse_and_validate_reply(raw_reply)
+        self.assertEqual(
+            result, 'Hello "Ada", JAMB Support here,\n\nSincerely,\nJAMB Support'
+        )
+
     def test_parse_and_validate_reply_invalid_json(self):
         raw_reply = "Invalid JSON"
         with self.assertRaises(APIResponseValidationError):
@@ -148,26 +556,367 @@ class TestGeminiProcessorIntegration(unittest.TestCase):
             self.processor.parse_and_validate_reply(raw_reply)
 
     def test_parse_and_validate_reply_malformed_json(self):
-        raw_reply = '```json\n{"content": "Hello [name], JAMB Support here,\\n\\nThis is a test reply.\\n\\nSincerely,\\nJAMB Support"}\n```'
+        raw_reply = f"```json\n{make_reply_json('[name]')}\n```"
         result = self.processor.parse_and_validate_reply(raw_reply)
         self.assertIn("Hello [name], JAMB Support here", result)
 
     def test_parse_and_validate_reply_with_square_brackets(self):
-        raw_reply = '{"content": "Hello [John Doe], JAMB Support here,\\n\\nThis is a test reply.\\n\\nSincerely,\\nJAMB Support"}'
+        raw_reply = make_reply_json("[John Doe]")
         result = self.processor.parse_and_validate_reply(raw_reply)
         self.assertIn("Hello [John Doe]", result)
 
     def test_parse_and_validate_reply_direct_extraction(self):
-        raw_reply = "Hello Jane Doe, JAMB Support here,\n\nThis is a test reply.\n\nSincerely,\nJAMB Support"
+        raw_reply = make_reply("Jane Doe")
         result = self.processor.parse_and_validate_reply(raw_reply)
         self.assertEqual(result, raw_reply)
 
     def test_format_reply(self):
-        content = "Hello [John Doe], JAMB Support here,\n\nThis is a test reply.\n\nSincerely,\nJAMB Support"
+        content = make_reply("[John Doe]")
         result = self.processor._format_reply(content)
         self.assertIn("Hello John Doe", result)
         self.assertNotIn("[John Doe]", result)
 
 
+class TestGetTicketData(PatchMixin, unittest.TestCase):
+    def setUp(self):
+        self.page = MagicMock()
+        self.pool = MagicMock()
+        self.pool.page.return_value.__aenter__ = AsyncMock(return_value=self.page)
+        self.pool.page.return_value.__aexit__ = AsyncMock(return_value=False)
+        self.start_patch(
+            "extraction.fetch_ticket_data", new=AsyncMock(return_value=None)
+        )
+
+    def test_failed_fetch_falls_back_to_page(self):
+        ticket_data = {"ticket_id": "#TEST-001", "messages": []}
+        mock_navigate = self.start_patch(
+            "extraction.navigate_to_ticket_page", new=AsyncMock(return_value=True)
+        )
+        mock_extract = self.start_patch(
+            "extraction.extract_ticket_data", new=AsyncMock(return_value=ticket_data)
+        )
+
+        result = asyncio.run(extraction.get_ticket_data(self.pool, "#TEST-001"))
+
+        self.assertIs(result, ticket_data)
+        mock_navigate.assert_awaited_once_with(self.page, "#TEST-001")
+        mock_extract.assert_awaited_once_with(self.page)
+
+    def test_failed_navigation_returns_none(self):
+        self.start_patch(
+            "extraction.navigate_to_ticket_page", new=AsyncMock(return_value=False)
+        )
+        mock_extract = self.start_patch("extraction.extract_ticket_data")
+
+        self.assertIsNone(
+            asyncio.run(extraction.get_ticket_data(self.pool, "#TEST-001"))
+        )
+        mock_extract.assert_not_called()
+
+    def test_expired_session_stops_scraping(self):
+        self.start_patch(
+            "extraction.fetch_ticket_data",
+            new=AsyncMock(side_effect=SessionExpiredError("#TEST-001")),
+        )
+        pending = deque(["#TEST-001", "#TEST-002"])
+        queue = asyncio.Queue()
+
+        asyncio.run(scrape_worker(self.pool, pending, queue))
+
+        self.assertFalse(pending)
+        self.assertTrue(queue.empty())
+
+    def test_scripts_share_the_extraction_path(self):
+        for script in (check_agent_last_reply, close_ticket_agent_reply_last):
+            self.assertIs(script.get_ticket_data, extraction.get_ticket_data)
+
+
+class TestTicketParsing(unittest.TestCase):
+    def setUp(self):
+        self.ticket = parse_ticket_html(TICKET_PAGE_HTML)
+
+    def test_ticket_info_rows(self):
+        info = {k: v for k, v in self.ticket.items() if k != "messages"}
+        self.assertEqual(
+            info,
+            {
+                "ticket_id": "#TEST-001",
+                "status": "Open",
+                "service_system": "Registration",
+                "sender_name": "John Doe",
+                "sender_email": "john@example.com",
+                "sender_phone": "08012345678",
+                "agent_name": "Agent Smith",
+                "issue": "Change of course",
+            },
+        )
+
+    def test_sent_and_replied_messages(self):
+        sent, replied = self.ticket["messages"]
+        self.assertEqual(sent["sender_name"], "John Doe")
+        self.assertEqual(sent["timestamp"], "2024-01-01 10:00")
+        self.assertEqual(sent["type"], "sent")
+        self.assertEqual(replied["agent_name"], "Agent Smith")
+        self.assertEqual(replied["type"], "replied")
+
+    def test_inline_markup_stays_on_one_line(self):
+        self.assertEqual(
+            self.ticket["messages"][0]["content"],
+            "Hello Support, my reg no is 12345.\nSecond para",
+        )
+
+    def test_line_breaks_split_content(self):
+        self.assertEqual(
+            self.ticket["messages"][1]["content"],
+            "Dear John,\nPlease re-upload it.",
+        )
+
+    @patch("extraction.ticket_request_bucket", new=MagicMock(acquire=AsyncMock()))
+    def test_http_and_tab_paths_parse_alike(self):
+        response = MagicMock(
+            ok=True,
+            text=AsyncMock(return_value=TICKET_PAGE_HTML),
+            dispose=AsyncMock(),
+        )
+        context = MagicMock()
+        context.request.get = AsyncMock(return_value=response)
+        page = MagicMock(
+            wait_for_selector=AsyncMock(),
+            content=AsyncMock(return_value=TICKET_PAGE_HTML),
+        )
+
+        fetched = asyncio.run(extraction.fetch_ticket_data(context, "#TEST-001"))
+        extracted = asyncio.run(extraction.extract_ticket_data(page))
+
+        self.assertEqual(fetched, extracted)
+        response.dispose.assert_awaited_once()
+        self.assertEqual(
+            extracted["messages"][0]["content"],
+            "Hello Support, my reg no is 12345.\nSecond para",
+        )
+
+    @patch("extraction.ticket_request_bucket", new=MagicMock(acquire=AsyncMock()))
+    def test_failed_fetch_disposes_response(self):
+        response = MagicMock(ok=False, status=500, dispose=AsyncMock())
+        context = MagicMock()
+        context.request.get = AsyncMock(return_value=response)
+
+        self.assertIsNone(
+            asyncio.run(extraction.fetch_ticket_data(context, "#TEST-001"))
+        )
+        response.dispose.assert_awaited_once()
+
+    @patch("extraction.ticket_request_bucket", new=MagicMock(acquire=AsyncMock()))
+    def test_login_redirect_raises_session_expired(self):
+        response = MagicMock(ok=True, url=f"{LOGIN_URL}/", dispose=AsyncMock())
+        context = MagicMock()
+        context.request.get = AsyncMock(return_value=response)
+
+        with self.assertRaises(SessionExpiredError):
+            asyncio.run(extraction.fetch_ticket_data(context, "#TEST-001"))
+        response.dispose.assert_awaited_once()
+
+    def test_page_without_ticket_content(self):
+        self.assertIsNone(parse_ticket_html("<html><body>Login</body></html>"))
+
+
+class TestTicketFiles(PatchMixin, unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.output_dir = tmp.name
+        # Start from a clean daily file cache pointed at the temp dir
+        utils.close_daily_tickets_handle()
+        self.addCleanup(utils.close_daily_tickets_handle)
+        self.start_patch("utils.JSON_OUTPUT_DIR", self.output_dir)
+        self.start_patch("utils._tickets_file_day", None)
+        self.start_patch("utils._tickets_file", None)
+
+    def test_saved_tickets_round_trip(self):
+        tickets = [
+            {"ticket_id": "#TEST-001", "next_reply": [{"content": "Hello"}]},
+            {"ticket_id": "#TEST-002", "next_reply": [{"content": "Hi"}]},
+        ]
+        for ticket in tickets:
+            utils.save_single_ticket_to_json(ticket)
+
+        filename = utils.daily_tickets_file()
+        self.assertEqual(os.path.dirname(filename), self.output_dir)
+        self.assertRegex(os.path.basename(filename), r"^tickets_\d{8}\.jsonl$")
+        self.assertEqual(list(utils.load_jsonl(filename)), tickets)
+
+        utils.export_jsonl_to_json(filename)
+        with open(os.path.splitext(filename)[0] + ".json") as jsonfile:
+            self.assertEqual(json.load(jsonfile), tickets)
+
+    def test_truncated_last_line_is_skipped(self):
+        filename = os.path.join(self.output_dir, "processed.jsonl")
+        utils.append_to_jsonl([{"ticket_id": "#TEST-001"}], filename)
+        # A crash mid-write leaves a partial, unterminated record
+        with open(filename, "ab") as jsonlfile:
+            jsonlfile.write(b'{"ticket_id": "#TE')
+        self.assertEqual(list(utils.load_jsonl(filename)), [{"ticket_id": "#TEST-001"}])
+
+        # The next append drops the partial record instead of gluing onto it
+        utils.append_to_jsonl([{"ticket_id": "#TEST-002"}], filename)
+        self.assertEqual(
+            [ticket["ticket_id"] for ticket in utils.load_jsonl(filename)],
+            ["#TEST-001", "#TEST-002"],
+        )
+
+    def test_corrupt_line_before_the_last_still_raises(self):
+        filename = os.path.join(self.output_dir, "processed.jsonl")
+        with open(filename, "wb") as jsonlfile:
+            jsonlfile.write(b'{"ticket_id": "#TE\n{"ticket_id": "#TEST-002"}\n')
+        with self.assertRaises(orjson.JSONDecodeError):
+            list(utils.load_jsonl(filename))
+
+    def test_creating_a_directory_is_logged_once(self):
+        self.start_patch("utils._created_dirs", set())
+        mock_logger = self.start_patch("utils.logger")
+        directory = os.path.join(self.output_dir, "out")
+        utils.ensure_directory_exists(directory)
+        utils.ensure_directory_exists(directory)
+
+        self.assertTrue(os.path.isdir(directory))
+        mock_logger.info.assert_called_once_with(f"Created directory: {directory}")
+
+    def patch_today(self, *days):
+        mock_date = self.start_patch("utils.date")
+        mock_date.today.side_effect = days
+
+    def test_handle_is_reused_across_flushes(self):
+        with utils.TicketWriter(batch_size=1) as writer:
+            writer.add({"ticket_id": "#TEST-001"})
+            handle = utils._tickets_handle
+            writer.add({"ticket_id": "#TEST-002"})
+            self.assertIs(utils._tickets_handle, handle)
+        self.assertFalse(handle.closed)
+        self.assertEqual(len(list(utils.load_jsonl(handle.name))), 2)
+
+    def test_handle_is_reopened_for_a_new_day(self):
+        self.patch_today(date(2026, 1, 1), date(2026, 1, 2))
+        utils.save_single_ticket_to_json({"ticket_id": "#TEST-001"})
+        first = utils._tickets_handle
+        utils.save_single_ticket_to_json({"ticket_id": "#TEST-002"})
+        second = utils._tickets_handle
+
+        self.assertTrue(first.closed)
+        self.assertFalse(second.closed)
+        self.assertTrue(first.name.endswith("tickets_20260101.jsonl"))
+        self.assertTrue(second.name.endswith("tickets_20260102.jsonl"))
+        self.assertEqual(
+            list(utils.load_jsonl(first.name)), [{"ticket_id": "#TEST-001"}]
+        )
+        self.assertEqual(
+            list(utils.load_jsonl(second.name)), [{"ticket_id": "#TEST-002"}]
+        )
+
+    def test_failed_write_closes_the_handle(self):
+        utils.save_single_ticket_to_json({"ticket_id": "#TEST-001"})
+        handle = utils._tickets_handle
+        # Writing to the closed file fails, as a full disk would
+        handle.close()
+        utils.save_single_ticket_to_json({"ticket_id": "#TEST-002"})
+        self.assertIsNone(utils._tickets_handle)
+
+        # The next save opens a fresh handle
+        utils.save_single_ticket_to_json({"ticket_id": "#TEST-003"})
+        self.assertIsNot(utils._tickets_handle, handle)
+        self.assertEqual(
+            [ticket["ticket_id"] for ticket in utils.load_jsonl(handle.name)],
+            ["#TEST-001", "#TEST-003"],
+        )
+
+    def test_batches_written_on_executor_stay_in_order(self):
+        tickets = [{"ticket_id": f"#TEST-{i:03}"} for i in range(1, 11)]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with utils.TicketWriter(batch_size=3, executor=executor) as writer:
+                for ticket in tickets[:-1]:
+                    writer.add(ticket)
+            utils.save_single_ticket_to_json(tickets[-1])
+
+        self.assertEqual(list(utils.load_jsonl(utils.daily_tickets_file())), tickets)
+
+
+class TestBrowserService(unittest.TestCase):
+    def setUp(self):
+        self.service = BrowserService()
+        self.service.stop = AsyncMock()
+        self.run = AsyncMock()
+
+    def test_serve_runs_once_without_interval(self):
+        with patch.dict("os.environ", {"JAMB_RUN_INTERVAL": "0"}):
+            asyncio.run(self.service.serve(self.run))
+        self.run.assert_awaited_once_with(self.service)
+        self.service.stop.assert_awaited_once()
+
+    def test_serve_reads_interval_at_run_time(self):
+        # Set after import, as load_dotenv() does in the scripts
+        with patch.dict("os.environ", {"JAMB_RUN_INTERVAL": "5"}), patch(
+            "browser.asyncio.sleep", new=AsyncMock(side_effect=asyncio.CancelledError)
+        ) as mock_sleep:
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(self.service.serve(self.run))
+        mock_sleep.assert_awaited_once_with(5)
+
+    def test_invalidated_context_logs_in_again(self):
+        first = MagicMock(close=AsyncMock())
+        second = MagicMock()
+        page = MagicMock(is_closed=MagicMock(return_value=False))
+        mock_open = AsyncMock(side_effect=[(first, page), (second, page)])
+
+        async def run():
+            with patch("browser.open_logged_in_context", new=mock_open):
+                self.assertIs(await self.service.get_context(), first)
+                self.assertIs(await self.service.get_context(), first)
+                await self.service.invalidate()
+                self.assertIs(await self.service.get_context(), second)
+
+        asyncio.run(run())
+        first.close.assert_awaited_once()
+        self.assertEqual(mock_open.await_count, 2)
+
+
+class TestValidation(unittest.TestCase):
+    def test_reply_form_markers_in_any_order(self):
+        content = "\n".join(reversed(REPLY_FORM_MARKERS))
+        self.assertTrue(has_reply_form_markers(content))
+        self.assertTrue(has_reply_form_markers(f"Before {content} after"))
+
+    def test_repeated_marker_is_not_enough(self):
+        content = " ".join([REPLY_FORM_MARKERS[0]] * 3)
+        self.assertFalse(has_reply_form_markers(content))
+        self.assertFalse(has_reply_form_markers(" ".join(REPLY_FORM_MARKERS[:2])))
+
+    def test_reply_form_message_is_rejected(self):
+        message = {
+            "agent_name": "Unknown Sender",
+            "timestamp": "N/A",
+            "content": "Message * write here... File Type: pdf Max file size: 2MB",
+            "type": "replied",
+        }
+        self.assertFalse(validate_message(message))
+        message["agent_name"] = "Agent Smith"
+        self.assertTrue(validate_message(message))
+
+    @patch("validation.logger")
+    def test_ticket_validation_logs_the_ticket_id(self, mock_logger):
+        ticket = {field: "x" for field in REQUIRED_TICKET_FIELDS}
+        ticket.update(ticket_id="#TEST-001", sender_phone="")
+        self.assertTrue(validate_ticket_data(ticket))
+        mock_logger.info.assert_any_call(
+            "Set missing field to N/A",
+            extra={"field": "sender_phone", "ticket_id": "#TEST-001"},
+        )
+
+        ticket["messages"] = []
+        self.assertFalse(validate_ticket_data(ticket))
+        mock_logger.warning.assert_called_once_with(
+            "Missing or empty required field",
+            extra={"field": "messages", "ticket_id": "#TEST-001"},
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,52 +1,174 @@
 # utils.py
 
-import json
+import atexit
+import logging
 import os
-from datetime import datetime
+import threading
+import orjson
+from datetime import date, datetime
 from logger import StructuredLogger
-from config import JSON_OUTPUT_DIR
+from config import JSON_OUTPUT_DIR, TICKET_WRITE_BATCH
 
 logger = StructuredLogger(__name__)
 
 
-def save_single_ticket_to_json(ticket):
-    filename = os.path.join(
-        JSON_OUTPUT_DIR, f"tickets_{datetime.now().strftime('%Y%m%d')}.json"
-    )
-    try:
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        if os.path.exists(filename):
-            with open(filename, "r+", encoding="utf-8") as jsonfile:
-                try:
-                    data = json.load(jsonfile)
-                except json.JSONDecodeError:
-                    data = []
-                data.append(ticket)
-                jsonfile.seek(0)
-                json.dump(data, jsonfile, ensure_ascii=False, indent=2)
-                jsonfile.truncate()
+def to_pretty_json(data):
+    """Indented JSON for console and log output, serialized with orjson."""
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+
+
+def dump_ticket_data(ticket_id, ticket_data):
+    """Print a scraped ticket when JAMB_DEBUG_DUMP is set, else debug-log it.
+
+    Dumping every ticket is slow on a terminal and interleaves under
+    concurrency, so it's opt-in.
+    """
+    if os.getenv("JAMB_DEBUG_DUMP"):
+        print(f"Ticket {ticket_id} data:")
+        print(to_pretty_json(ticket_data))
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Ticket {ticket_id} data: {to_pretty_json(ticket_data)}")
+
+
+_tickets_file_day = None
+_tickets_file = None
+# Directories this process has already made sure exist
+_created_dirs = set()
+
+
+def daily_tickets_file():
+    """Path of today's tickets JSON Lines file.
+
+    The path is rebuilt only when the date changes, and the output
+    directory is created at most once per process rather than on every
+    save.
+    """
+    global _tickets_file_day, _tickets_file
+    today = date.today()
+    if today != _tickets_file_day:
+        if JSON_OUTPUT_DIR not in _created_dirs:
+            os.makedirs(JSON_OUTPUT_DIR, exist_ok=True)
+            _created_dirs.add(JSON_OUTPUT_DIR)
+        _tickets_file = os.path.join(JSON_OUTPUT_DIR, f"tickets_{today:%Y%m%d}.jsonl")
+        _tickets_file_day = today
+    return _tickets_file
+
+
+_tickets_handle = None
+# Held around every use of the handle, since batches may be written from a
+# save thread while the event loop saves single tickets
+_tickets_lock = threading.Lock()
+
+
+def daily_tickets_handle():
+    """Append handle on today's tickets file.
+
+    The handle stays open across saves and is only reopened when the date
+    changes, or after a failed write.
+    """
+    global _tickets_handle
+    filename = daily_tickets_file()
+    if _tickets_handle is None or _tickets_handle.name != filename:
+        close_daily_tickets_handle()
+        _tickets_handle = open(filename, "ab")
+    return _tickets_handle
+
+
+def close_daily_tickets_handle():
+    global _tickets_handle
+    if _tickets_handle is not None:
+        try:
+            _tickets_handle.close()
+        finally:
+            _tickets_handle = None
+
+
+atexit.register(close_daily_tickets_handle)
+
+
+class TicketWriter:
+    """Buffer tickets and append them to the day's JSON Lines file in batches.
+
+    Tickets are serialized as they are added and written with a single
+    write per `batch_size` tickets to the shared daily handle. Use it as a
+    context manager so the last partial batch is flushed on exit.
+
+    With an `executor`, batches are written on it rather than in the
+    caller's thread; exiting the context waits for those writes. Use a
+    single-worker executor to keep batches in order.
+    """
+
+    def __init__(self, batch_size=TICKET_WRITE_BATCH, executor=None):
+        self.batch_size = batch_size
+        self.executor = executor
+        self._buf = []
+        self._writes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        for write in self._writes:
+            write.result()
+        self._writes.clear()
+
+    def add(self, ticket):
+        self._buf.append(orjson.dumps(ticket))
+        if len(self._buf) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buf:
+            return
+        batch, self._buf = self._buf, []
+        if self.executor is None:
+            _write_tickets(batch)
         else:
-            with open(filename, "w", encoding="utf-8") as jsonfile:
-                json.dump([ticket], jsonfile, ensure_ascii=False, indent=2)
-        logger.info(f"Saved ticket {ticket.get('ticket_id', 'Unknown')} to {filename}")
-    except Exception as e:
-        logger.error(
-            f"Failed to save ticket {ticket.get('ticket_id', 'Unknown')} to JSON: {str(e)}",
-            extra={
-                "exception": str(e),
-                "ticket_id": ticket.get("ticket_id", "Unknown"),
-            },
-        )
-        logger.error(f"Current working directory: {os.getcwd()}")
-        logger.error(f"File path attempted: {os.path.abspath(filename)}")
+            self._writes.append(self.executor.submit(_write_tickets, batch))
+
+
+def _write_tickets(batch):
+    filename = None
+    with _tickets_lock:
+        try:
+            jsonlfile = daily_tickets_handle()
+            filename = jsonlfile.name
+            jsonlfile.write(b"\n".join(batch) + b"\n")
+            jsonlfile.flush()
+            logger.info(f"Saved {len(batch)} tickets to {filename}")
+        except Exception as e:
+            close_daily_tickets_handle()
+            logger.error(
+                f"Failed to save {len(batch)} tickets to JSON: {str(e)}",
+                extra={"exception": str(e)},
+            )
+            logger.error(f"Current working directory: {os.getcwd()}")
+            logger.error(
+                f"File path attempted: {os.path.abspath(filename or JSON_OUTPUT_DIR)}"
+            )
+
+
+def save_single_ticket_to_json(ticket):
+    """Append a ticket to the day's JSON Lines file.
+
+    Prefer a TicketWriter when saving several tickets in a row. Use
+    export_jsonl_to_json for a JSON array copy.
+    """
+    with TicketWriter(batch_size=1) as writer:
+        writer.add(ticket)
 
 
 def save_to_json(data, filename=None):
     if filename is None:
         filename = f"tickets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
     try:
-        with open(filename, "w", encoding="utf-8") as jsonfile:
-            json.dump(data, jsonfile, ensure_ascii=False, indent=2)
+        with open(filename, "wb") as jsonfile:
+            jsonfile.write(
+                orjson.dumps(
+                    data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE
+                )
+            )
         logger.info(f"Saved {len(data)} tickets to {filename}")
     except Exception as e:
         logger.error(
@@ -54,23 +176,108 @@ def save_to_json(data, filename=None):
         )
 
 
+def _drop_partial_last_line(jsonlfile, block_size=65536):
+    """Truncate an unterminated last line, as left by a crash mid-write.
+
+    Otherwise the next record would be glued onto the partial one. Only
+    the last byte is read when the file ends cleanly.
+    """
+    end = jsonlfile.seek(0, os.SEEK_END)
+    if end == 0:
+        return
+    jsonlfile.seek(end - 1)
+    if jsonlfile.read(1) == b"\n":
+        return
+    pos = end
+    while pos > 0:
+        start = max(0, pos - block_size)
+        jsonlfile.seek(start)
+        newline = jsonlfile.read(pos - start).rfind(b"\n")
+        if newline != -1:
+            pos = start + newline + 1
+            break
+        pos = start
+    logger.warning(
+        f"Dropping {end - pos} bytes of a partial last line in {jsonlfile.name}"
+    )
+    jsonlfile.truncate(pos)
+
+
+def append_to_jsonl(records, filename):
+    """Append records to a JSON Lines file and sync it to disk.
+
+    Only the new records are serialized, so checkpointing cost stays
+    proportional to the batch rather than to everything saved so far.
+    """
+    with open(filename, "a+b") as jsonlfile:
+        _drop_partial_last_line(jsonlfile)
+        jsonlfile.writelines(orjson.dumps(record) + b"\n" for record in records)
+        jsonlfile.flush()
+        os.fsync(jsonlfile.fileno())
+
+
+def load_jsonl(filename):
+    """Yield the records of a JSON Lines file, skipping blank lines.
+
+    A last line that doesn't decode, as left by a crash mid-write, is
+    logged and skipped; a bad line anywhere else still raises.
+    """
+    with open(filename, "rb") as jsonlfile:
+        lines = (line for line in jsonlfile if line.strip())
+        line = next(lines, None)
+        while line is not None:
+            next_line = next(lines, None)
+            try:
+                record = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                if next_line is not None:
+                    raise
+                logger.warning(
+                    f"Skipping truncated last line of {filename}",
+                    extra={"exception": str(e)},
+                )
+                return
+            yield record
+            line = next_line
+
+
+def export_jsonl_to_json(jsonl_filename, json_filename=None):
+    """Write the records of a JSON Lines file out as one JSON array."""
+    if json_filename is None:
+        json_filename = os.path.splitext(jsonl_filename)[0] + ".json"
+    save_to_json(list(load_jsonl(jsonl_filename)), json_filename)
+
+
+SENSITIVE_FIELDS = frozenset({"sender_email", "sender_phone"})
+
+
 def redact_sensitive_info(ticket_data):
-    redacted_data = ticket_data.copy()
-    sensitive_fields = ["sender_email", "sender_phone"]
-    for field in sensitive_fields:
-        if field in redacted_data:
-            redacted_data[field] = "REDACTED"
-    return redacted_data
+    """Return the ticket with its sensitive fields redacted.
+
+    A ticket without any sensitive fields is returned as is rather than
+    copied, so the result must not be mutated.
+    """
+    if SENSITIVE_FIELDS.isdisjoint(ticket_data):
+        return ticket_data
+    return {
+        key: "REDACTED" if key in SENSITIVE_FIELDS else value
+        for key, value in ticket_data.items()
+    }
 
 
 def ensure_directory_exists(directory):
-    if not os.path.exists(directory):
-        try:
-            os.makedirs(directory)
-            logger.info(f"Created directory: {directory}")
-        except Exception as e:
-            logger.error(
-                f"Failed to create directory {directory}: {str(e)}",
-                extra={"exception": str(e), "directory": directory},
-            )
-            raise
+    # A single makedirs call rather than check-then-create, which races with
+    # anything else creating it. The stat is only paid for the log line.
+    log_created = logger.isEnabledFor(logging.INFO)
+    existed = log_created and os.path.isdir(directory)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        logger.error(
+            f"Failed to create directory {directory}: {str(e)}",
+            extra={"exception": str(e), "directory": directory},
+        )
+        raise
+    _created_dirs.add(directory)
+    if log_created and not existed:
+        logger.info(f"Created directory: {directory}")
@@ -1,75 +1,104 @@
 # validation.py
 
+import re
 from config import MINIMUM_MESSAGE_LENGTH
 from logger import StructuredLogger
 
 logger = StructuredLogger(__name__)
 
+# Text of the reply form that gets scraped as a bogus timeline message
+REPLY_FORM_MARKERS = ("Message * write here...", "File Type:", "Max file size:")
+REPLY_FORM_MARKERS_RE = re.compile("|".join(map(re.escape, REPLY_FORM_MARKERS)))
+
+
+PLACEHOLDER_TIMESTAMPS = frozenset({"N/A", "Unknown Time"})
+
+
+def has_reply_form_markers(content):
+    """Whether the content contains every reply form marker.
+
+    One pass over the content, stopping as soon as the last marker is seen.
+    """
+    found = set()
+    for match in REPLY_FORM_MARKERS_RE.finditer(content):
+        found.add(match.group())
+        if len(found) == len(REPLY_FORM_MARKERS):
+            return True
+    return False
+
 
 def validate_message(message):
+    content = message.get("content", "")
+    unknown_sender = message.get("agent_name") == "Unknown Sender"
+    timestamp = message.get("timestamp")
+
     # Check for the specific invalid message pattern
     if (
-        message.get("agent_name") == "Unknown Sender"
-        and message.get("timestamp") in ["N/A", "Unknown Time"]
-        and "Message * write here..." in message.get("content", "")
-        and "File Type:" in message.get("content", "")
-        and "Max file size:" in message.get("content", "")
+        unknown_sender
+        and timestamp in PLACEHOLDER_TIMESTAMPS
+        and has_reply_form_markers(content)
     ):
-        logger.warning(f"Invalid message pattern detected: {message}")
+        logger.warning(
+            "Invalid message pattern detected", extra={"timeline_message": message}
+        )
         return False
 
     # Check for minimum content length
-    if len(message.get("content", "").strip()) < MINIMUM_MESSAGE_LENGTH:
-        logger.warning(f"Message content too short: {message}")
+    if len(content.strip()) < MINIMUM_MESSAGE_LENGTH:
+        logger.warning("Message content too short", extra={"timeline_message": message})
         return False
 
     # Additional check for "Unknown Sender" with "Unknown Time"
-    if (
-        message.get("agent_name") == "Unknown Sender"
-        and message.get("timestamp") == "Unknown Time"
-    ):
+    if unknown_sender and timestamp == "Unknown Time":
         logger.warning(
-            f"Invalid message detected (Unknown Sender with Unknown Time): {message}"
+            "Invalid message detected (Unknown Sender with Unknown Time)",
+            extra={"timeline_message": message},
         )
         return False
 
-    logger.info(f"Valid message: {message}")
+    logger.debug("Valid message", extra={"timeline_message": message})
     return True
 
 
+REQUIRED_TICKET_FIELDS = (
+    "ticket_id",
+    "status",
+    "service_system",
+    "issue",
+    "sender_name",
+    "sender_email",
+    "sender_phone",
+    "agent_name",
+    "messages",
+)
+# Required fields that are filled with N/A instead of failing validation
+OPTIONAL_CONTACT_FIELDS = frozenset({"sender_email", "sender_phone"})
+
+
 def validate_ticket_data(ticket_data):
-    required_fields = [
-        "ticket_id",
-        "status",
-        "service_system",
-        "issue",
-        "sender_name",
-        "sender_email",
-        "sender_phone",
-        "agent_name",
-        "messages",
-    ]
-    for field in required_fields:
-        if field not in ticket_data or not ticket_data[field]:
-            if field in ["sender_email", "sender_phone"]:
-                ticket_data[field] = "N/A"
-                logger.info(
-                    f"Set missing {field} to N/A for ticket {ticket_data.get('ticket_id', 'Unknown')}"
-                )
-            else:
-                logger.warning(
-                    f"Missing or empty required field: {field} for ticket {ticket_data.get('ticket_id', 'Unknown')}"
-                )
-                return False
+    ticket_id = ticket_data.get("ticket_id")
+    for field in REQUIRED_TICKET_FIELDS:
+        if ticket_data.get(field):
+            continue
+        if field in OPTIONAL_CONTACT_FIELDS:
+            ticket_data[field] = "N/A"
+            logger.info(
+                "Set missing field to N/A",
+                extra={"field": field, "ticket_id": ticket_id},
+            )
+        else:
+            logger.warning(
+                "Missing or empty required field",
+                extra={"field": field, "ticket_id": ticket_id},
+            )
+            return False
 
     # Ensure that at least one valid message exists in the ticket
     if not ticket_data["messages"]:
         logger.warning(
-            f"No valid messages found for ticket {ticket_data.get('ticket_id', 'Unknown')}"
+            "No valid messages found for ticket", extra={"ticket_id": ticket_id}
         )
         return False
 
-    logger.info(
-        f"Ticket {ticket_data.get('ticket_id', 'Unknown')} validated successfully"
-    )
+    logger.info("Ticket validated successfully", extra={"ticket_id": ticket_id})
     return True